@@ -0,0 +1,108 @@
+#Benchmark: latencia de solicitudes a Siigo creando un httpx.AsyncClient por llamada
+#(comportamiento anterior) contra el cliente compartido con pool de conexiones.
+#
+#uso:
+#   python benchmarks/bench_http_client.py                       #servidor local de prueba
+#   python benchmarks/bench_http_client.py --url https://api.siigo.com/ --requests 50
+#
+#Contra un servidor HTTPS real la diferencia incluye el handshake TLS de cada conexion nueva.
+import argparse
+import asyncio
+import os
+import statistics
+import sys
+import threading
+import time
+
+import httpx
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from siigo_api import create_http_client  # noqa: E402
+
+
+def percentile(values, pct):
+    ordered = sorted(values)
+    index = min(len(ordered) - 1, max(0, round(pct / 100 * len(ordered)) - 1))
+    return ordered[index]
+
+
+def start_local_server(port: int):
+    #servidor minimo que responde como el endpoint de clientes de Siigo
+    import uvicorn
+    from fastapi import FastAPI
+
+    app = FastAPI()
+
+    @app.get("/customers")
+    async def customers():
+        return {"results": []}
+
+    server = uvicorn.Server(uvicorn.Config(app, host="127.0.0.1", port=port, log_level="warning"))
+    thread = threading.Thread(target=server.run, daemon=True)
+    thread.start()
+    while not server.started:
+        time.sleep(0.05)
+    return server
+
+
+async def run_per_call_client(url, requests, verify):
+    latencies = []
+    for _ in range(requests):
+        start = time.perf_counter()
+        async with httpx.AsyncClient(verify=verify) as client:
+            await client.get(url)
+        latencies.append((time.perf_counter() - start) * 1000)
+    return latencies
+
+
+async def run_shared_client(url, requests, http2, verify):
+    latencies = []
+    client = create_http_client(http2=http2)
+    if not verify:
+        await client.aclose()
+        client = httpx.AsyncClient(verify=False, http2=http2, limits=httpx.Limits(max_keepalive_connections=10))
+    try:
+        for _ in range(requests):
+            start = time.perf_counter()
+            await client.get(url)
+            latencies.append((time.perf_counter() - start) * 1000)
+    finally:
+        await client.aclose()
+    return latencies
+
+
+def report(name, latencies):
+    print(f"{name:<28} p50={statistics.median(latencies):8.2f} ms  "
+          f"p99={percentile(latencies, 99):8.2f} ms  media={statistics.mean(latencies):8.2f} ms")
+
+
+async def main():
+    parser = argparse.ArgumentParser(description="Benchmark del cliente HTTP compartido para Siigo")
+    parser.add_argument("--url", help="URL a consultar; si se omite se levanta un servidor local")
+    parser.add_argument("--requests", type=int, default=200)
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--http2", action="store_true", help="usar HTTP/2 en el cliente compartido")
+    parser.add_argument("--insecure", action="store_true", help="no verificar certificados TLS")
+    args = parser.parse_args()
+
+    server = None
+    url = args.url
+    if not url:
+        server = start_local_server(args.port)
+        url = f"http://127.0.0.1:{args.port}/customers"
+
+    verify = not args.insecure
+    try:
+        per_call = await run_per_call_client(url, args.requests, verify)
+        shared = await run_shared_client(url, args.requests, args.http2, verify)
+    finally:
+        if server:
+            server.should_exit = True
+
+    print(f"{args.requests} solicitudes a {url}")
+    report("cliente por solicitud", per_call)
+    report("cliente compartido (pool)", shared)
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,244 @@
+#Pruebas de carga del servicio contra servicios falsos locales (Siigo, Google Sheets y SMTP, ver fakes.py).
+#El servicio corre en un proceso aparte (run_app.py) con las variables de entorno apuntando a los falsos.
+#
+#escenarios:
+#   register    POST /register-from-timbale con identificaciones nuevas (y una fraccion repetida)
+#   sheet-sync  una sincronizacion completa de la hoja (process_sheet_data)
+#
+#uso:
+#   python benchmarks/bench_load.py register --requests 500 --concurrency 20 --siigo-latency-ms 80
+#   python benchmarks/bench_load.py register --siigo-429-rate 0.05 --siigo-error-rate 0.02
+#   python benchmarks/bench_load.py sheet-sync --sheet-rows 5000
+#   python benchmarks/bench_load.py register --json resultados.json   #para comparar entre versiones
+#
+#Por defecto la cuota de Siigo del servicio (SIIGO_REQUESTS_PER_MINUTE) se sube para medir el servicio y
+#no el limitador; use --siigo-rpm 100 para reproducir la cuota real.
+import argparse
+import asyncio
+import datetime
+import json
+import os
+import random
+import socket
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+import httpx
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+from bench_http_client import percentile  # noqa: E402
+from fakes import FakeUpstreams, SiigoFakeConfig  # noqa: E402
+
+RUN_APP = os.path.join(os.path.dirname(os.path.abspath(__file__)), "run_app.py")
+SCOPES = ["https://www.googleapis.com/auth/spreadsheets.readonly", "https://www.googleapis.com/auth/drive"]
+
+
+def free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+#directorio de trabajo con credenciales de Google falsas (token vigente, no se contacta a Google)
+def prepare_workdir() -> str:
+    workdir = tempfile.mkdtemp(prefix="timbale-bench-")
+    os.makedirs(os.path.join(workdir, "credentials"))
+    secrets = {"installed": {"client_id": "bench", "client_secret": "bench", "auth_uri": "http://127.0.0.1/auth",
+                             "token_uri": "http://127.0.0.1/token", "redirect_uris": ["http://localhost"]}}
+    with open(os.path.join(workdir, "credentials", "client_secrets.json"), "w") as f:
+        json.dump(secrets, f)
+    expiry = (datetime.datetime.utcnow() + datetime.timedelta(days=1)).strftime("%Y-%m-%dT%H:%M:%SZ")
+    token = {"token": "bench", "refresh_token": "bench", "client_id": "bench", "client_secret": "bench",
+             "token_uri": "http://127.0.0.1/token", "expiry": expiry, "scopes": SCOPES}
+    with open(os.path.join(workdir, "token.json"), "w") as f:
+        json.dump(token, f)
+    return workdir
+
+
+def service_env(upstreams: FakeUpstreams, workdir: str, args) -> dict:
+    env = dict(os.environ)
+    env.update({
+        "SIIGO_PARTNER_ID": "bench",
+        "SIIGO_API_USERNAME": "bench",
+        "SIIGO_API_PASSWORD": "bench",
+        "GOOGLE_CREDS_PATH": os.path.join(workdir, "service_account.json"),
+        "SHEET_ID": "bench-sheet",
+        "SMTP_USERNAME": "bench@example.com",
+        "SMTP_PASSWORD": "bench",
+        "LOCAL_DB_PATH": os.path.join(workdir, "timbale_local.db"),
+        "CUSTOMER_INDEX_BULK_LOAD": "false",
+        "SIIGO_REQUESTS_PER_MINUTE": str(args.siigo_rpm),
+        "SIIGO_RATE_BURST": str(max(10, int(args.siigo_rpm / 60))),
+        "LOG_LEVEL": "WARNING",
+    })
+    env.update(upstreams.service_env())
+    return env
+
+
+def start_service(env: dict, workdir: str, port: int) -> subprocess.Popen:
+    process = subprocess.Popen([sys.executable, RUN_APP, "--port", str(port)], cwd=workdir, env=env)
+    deadline = time.monotonic() + 60
+    while time.monotonic() < deadline:
+        if process.poll() is not None:
+            raise RuntimeError(f"El servicio termino al iniciar (codigo {process.returncode})")
+        try:
+            if httpx.get(f"http://127.0.0.1:{port}/health", timeout=1).status_code == 200:
+                return process
+        except httpx.HTTPError:
+            pass
+        time.sleep(0.2)
+    process.terminate()
+    raise RuntimeError("El servicio no respondio /health en 60 s")
+
+
+def registration_payload(number: int) -> dict:
+    return {
+        "first_name": f"Nombre{number}",
+        "last_name": f"Apellido{number}",
+        "email": f"bench{number}@example.com",
+        "phone": f"300{number % 10000000:07d}",
+        "identification": f"7{number:09d}",
+        "address": f"Calle {number} # 1-23",
+        "city": "11001",
+    }
+
+
+async def run_registrations(base_url: str, requests: int, concurrency: int, duplicate_rate: float) -> dict:
+    latencies = []
+    statuses = {}
+    counter = iter(range(requests))
+    rng = random.Random(42)  #misma secuencia de repetidos en cada ejecucion
+
+    async def worker(client: httpx.AsyncClient):
+        for index in counter:
+            #una fraccion de las solicitudes repite una identificacion anterior (formulario enviado dos veces)
+            number = index - 1 if index and rng.random() < duplicate_rate else index
+            start = time.perf_counter()
+            try:
+                response = await client.post(f"{base_url}/register-from-timbale", json=registration_payload(number))
+                status = str(response.status_code)
+            except httpx.HTTPError as e:
+                status = type(e).__name__
+            latencies.append((time.perf_counter() - start) * 1000)
+            statuses[status] = statuses.get(status, 0) + 1
+
+    limits = httpx.Limits(max_connections=concurrency, max_keepalive_connections=concurrency)
+    async with httpx.AsyncClient(timeout=120, limits=limits) as client:
+        start = time.perf_counter()
+        await asyncio.gather(*(worker(client) for _ in range(concurrency)))
+        elapsed = time.perf_counter() - start
+    return {"latencies": latencies, "statuses": statuses, "elapsed": elapsed}
+
+
+#espera a que la outbox envie los correos de bienvenida pendientes
+def wait_outbox_drained(base_url: str, timeout: float = 60) -> int:
+    deadline = time.monotonic() + timeout
+    pending = None
+    while time.monotonic() < deadline:
+        pending = httpx.get(f"{base_url}/health", timeout=5).json().get("outbox_pending", 0)
+        if not pending:
+            return 0
+        time.sleep(0.5)
+    return pending
+
+
+def latency_summary(latencies: list) -> dict:
+    return {
+        "p50_ms": round(statistics.median(latencies), 2),
+        "p90_ms": round(percentile(latencies, 90), 2),
+        "p99_ms": round(percentile(latencies, 99), 2),
+        "max_ms": round(max(latencies), 2),
+        "mean_ms": round(statistics.mean(latencies), 2),
+    }
+
+
+def scenario_register(upstreams: FakeUpstreams, workdir: str, args) -> dict:
+    port = free_port()
+    base_url = f"http://127.0.0.1:{port}"
+    process = start_service(service_env(upstreams, workdir, args), workdir, port)
+    try:
+        upstreams.reset()
+        run = asyncio.run(run_registrations(base_url, args.requests, args.concurrency, args.duplicate_rate))
+        outbox_pending = wait_outbox_drained(base_url)
+    finally:
+        process.terminate()
+        process.wait(timeout=30)
+
+    completed = sum(count for status, count in run["statuses"].items() if status.startswith("2"))
+    siigo_calls = upstreams.siigo_stats.snapshot()
+    siigo_total = sum(count for key, count in siigo_calls.items() if not key.endswith("idempotent_replay"))
+    return {
+        "scenario": "register",
+        "requests": args.requests,
+        "concurrency": args.concurrency,
+        "rps": round(args.requests / run["elapsed"], 2),
+        **latency_summary(run["latencies"]),
+        "statuses": run["statuses"],
+        "siigo_calls": siigo_calls,
+        "siigo_calls_per_registration": round(siigo_total / completed, 3) if completed else None,
+        "emails_sent": upstreams.smtp.messages,
+        "smtp_connections": upstreams.smtp.connections,
+        "outbox_pending_at_end": outbox_pending,
+    }
+
+
+def scenario_sheet_sync(upstreams: FakeUpstreams, workdir: str, args) -> dict:
+    env = service_env(upstreams, workdir, args)
+    upstreams.reset()
+    output = subprocess.run([sys.executable, RUN_APP, "--sync-once"], cwd=workdir, env=env,
+                            capture_output=True, text=True, timeout=3600)
+    if output.returncode != 0:
+        raise RuntimeError(f"La sincronizacion fallo:\n{output.stderr[-2000:]}")
+    report = json.loads(output.stdout.strip().splitlines()[-1])
+    rows = report["total"]
+    siigo_total = upstreams.siigo_stats.total()
+    return {
+        "scenario": "sheet-sync",
+        "rows": rows,
+        "rows_per_second": round(rows / report["wall_seconds"], 2) if report["wall_seconds"] else None,
+        "report": report,
+        "sheets_calls": upstreams.sheets_stats.snapshot(),
+        "siigo_calls": upstreams.siigo_stats.snapshot(),
+        "siigo_calls_per_row": round(siigo_total / rows, 3) if rows else None,
+    }
+
+
+SCENARIOS = {"register": scenario_register, "sheet-sync": scenario_sheet_sync}
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Pruebas de carga del servicio con Siigo, Sheets y SMTP falsos")
+    parser.add_argument("scenario", choices=sorted(SCENARIOS))
+    parser.add_argument("--requests", type=int, default=200)
+    parser.add_argument("--concurrency", type=int, default=10)
+    parser.add_argument("--duplicate-rate", type=float, default=0.0, help="fraccion de registros que repiten identificacion")
+    parser.add_argument("--siigo-rpm", type=float, default=100000, help="SIIGO_REQUESTS_PER_MINUTE del servicio")
+    parser.add_argument("--siigo-latency-ms", type=float, default=50)
+    parser.add_argument("--siigo-jitter-ms", type=float, default=20)
+    parser.add_argument("--siigo-429-rate", type=float, default=0.0)
+    parser.add_argument("--siigo-error-rate", type=float, default=0.0)
+    parser.add_argument("--siigo-existing-rate", type=float, default=0.0)
+    parser.add_argument("--sheet-rows", type=int, default=1000)
+    parser.add_argument("--sheets-latency-ms", type=float, default=100)
+    parser.add_argument("--json", help="archivo donde guardar el resultado")
+    args = parser.parse_args()
+
+    config = SiigoFakeConfig(args.siigo_latency_ms, args.siigo_jitter_ms, args.siigo_429_rate,
+                             args.siigo_error_rate, args.siigo_existing_rate)
+    upstreams = FakeUpstreams(config, args.sheet_rows, args.sheets_latency_ms).start()
+    try:
+        result = SCENARIOS[args.scenario](upstreams, prepare_workdir(), args)
+    finally:
+        upstreams.stop()
+
+    print(json.dumps(result, indent=2, ensure_ascii=False))
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump(result, f, indent=2, ensure_ascii=False)
+
+
+if __name__ == "__main__":
+    main()
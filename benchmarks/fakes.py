@@ -0,0 +1,323 @@
+#Servicios locales que imitan a Siigo, a la API de valores de Google Sheets y a un servidor SMTP,
+#para medir el servicio sin tocar produccion.
+#
+#uso independiente (los puertos se imprimen al iniciar):
+#   python benchmarks/fakes.py --siigo-latency-ms 80 --siigo-429-rate 0.05 --sheet-rows 5000
+#
+#Cada servicio falso cuenta las llamadas recibidas; GET /__stats las devuelve y POST /__reset las reinicia.
+import argparse
+import asyncio
+import base64
+import random
+import re
+import threading
+import time
+import uuid
+
+import uvicorn
+from fastapi import FastAPI, Request
+from fastapi.responses import JSONResponse
+
+
+class SiigoFakeConfig:
+    def __init__(self, latency_ms: float = 50, jitter_ms: float = 20, rate_429: float = 0.0,
+                 error_rate: float = 0.0, existing_rate: float = 0.0, retry_after: float = 1):
+        self.latency_ms = latency_ms
+        self.jitter_ms = jitter_ms
+        self.rate_429 = rate_429  #fraccion de solicitudes que reciben 429
+        self.error_rate = error_rate  #fraccion de solicitudes que reciben 500
+        self.existing_rate = existing_rate  #fraccion de identificaciones que Siigo reporta como existentes
+        self.retry_after = retry_after
+
+
+#contador de llamadas por clave ("GET /customers 200"), compartido entre hilos
+class CallStats:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.calls = {}
+
+    def add(self, key: str):
+        with self._lock:
+            self.calls[key] = self.calls.get(key, 0) + 1
+
+    def total(self, prefix: str = "") -> int:
+        with self._lock:
+            return sum(count for key, count in self.calls.items() if key.startswith(prefix))
+
+    def snapshot(self) -> dict:
+        with self._lock:
+            return dict(self.calls)
+
+    def reset(self):
+        with self._lock:
+            self.calls = {}
+
+
+def create_siigo_app(config: SiigoFakeConfig, stats: CallStats) -> FastAPI:
+    app = FastAPI()
+    customers = {}  #identificacion -> id
+    idempotency = {}  #clave de idempotencia -> id
+
+    async def simulate(request: Request):
+        delay = max(0.0, random.gauss(config.latency_ms, config.jitter_ms)) / 1000
+        await asyncio.sleep(delay)
+        roll = random.random()
+        if roll < config.rate_429:
+            return JSONResponse(status_code=429, content={"Errors": [{"Code": "too_many_requests"}]},
+                                headers={"Retry-After": str(config.retry_after)})
+        if roll < config.rate_429 + config.error_rate:
+            return JSONResponse(status_code=500, content={"Errors": [{"Code": "internal_error"}]})
+        return None
+
+    def record(request: Request, status: int):
+        stats.add(f"{request.method} {request.url.path} {status}")
+
+    @app.post("/auth")
+    async def auth(request: Request):
+        failure = await simulate(request)
+        if failure is not None:
+            record(request, failure.status_code)
+            return failure
+        record(request, 200)
+        return {"access_token": uuid.uuid4().hex, "expires_in": 86400, "token_type": "Bearer"}
+
+    @app.get("/customers")
+    async def list_customers(request: Request, identification: str = None, page: int = 1):
+        failure = await simulate(request)
+        if failure is not None:
+            record(request, failure.status_code)
+            return failure
+        record(request, 200)
+        if identification is None:
+            return {"results": [], "pagination": {"page": page, "total_results": 0}}
+        customer_id = customers.get(identification)
+        if customer_id is None and random.random() < config.existing_rate:
+            customer_id = customers[identification] = str(uuid.uuid4())
+        results = [{"id": customer_id, "identification": identification}] if customer_id else []
+        return {"results": results, "pagination": {"page": 1, "total_results": len(results)}}
+
+    @app.post("/customers")
+    async def create_customer(request: Request):
+        failure = await simulate(request)
+        if failure is not None:
+            record(request, failure.status_code)
+            return failure
+        data = await request.json()
+        key = request.headers.get("idempotency-key")
+        if key and key in idempotency:
+            stats.add("POST /customers idempotent_replay")
+            record(request, 201)
+            return JSONResponse(status_code=201, content={"id": idempotency[key], "identification": data.get("identification")})
+        customer_id = str(uuid.uuid4())
+        customers[data.get("identification")] = customer_id
+        if key:
+            idempotency[key] = customer_id
+        record(request, 201)
+        return JSONResponse(status_code=201, content={"id": customer_id, "identification": data.get("identification")})
+
+    add_stats_routes(app, stats)
+    return app
+
+
+#fila con el formato de la hoja de registros (31 columnas, ver sheet_transform.py)
+def fake_sheet_row(number: int) -> list:
+    row = [""] * 31
+    row[0] = f"8{number:09d}"
+    row[3] = "Nombre"
+    row[4] = "Persona Natural"
+    row[5] = f"Cliente {number}"
+    row[6] = f"Nombre{number}"
+    row[7] = f"Apellido{number}"
+    row[9] = f"Calle {number} # 1-23"
+    row[14] = f"300{number % 10000000:07d}"
+    row[16] = "0 - No responsable de IVA"
+    row[24] = f"cliente{number}@example.com"
+    row[30] = "Activo"
+    return row
+
+
+def create_sheets_app(rows: int, latency_ms: float, stats: CallStats) -> FastAPI:
+    app = FastAPI()
+    range_pattern = re.compile(r"([A-Z]+)(\d+):([A-Z]+)(\d+)$")
+
+    @app.get("/v4/spreadsheets/{spreadsheet_id}")
+    async def spreadsheet(spreadsheet_id: str):
+        stats.add("GET spreadsheets.get")
+        await asyncio.sleep(latency_ms / 1000)
+        return {"sheets": [{"properties": {"title": "Registros", "gridProperties": {"rowCount": rows}}}]}
+
+    @app.get("/v4/spreadsheets/{spreadsheet_id}/values:batchGet")
+    async def batch_get(request: Request, spreadsheet_id: str):
+        stats.add("GET values.batchGet")
+        await asyncio.sleep(latency_ms / 1000)
+        value_ranges = []
+        for sheet_range in request.query_params.getlist("ranges"):
+            match = range_pattern.search(sheet_range.split("!")[-1])
+            start, end = int(match.group(2)), min(int(match.group(4)), rows)
+            value_ranges.append({"range": sheet_range, "values": [fake_sheet_row(n) for n in range(start, end + 1)]})
+        return {"spreadsheetId": spreadsheet_id, "valueRanges": value_ranges}
+
+    add_stats_routes(app, stats)
+    return app
+
+
+def add_stats_routes(app: FastAPI, stats: CallStats):
+    @app.get("/__stats")
+    async def get_stats():
+        return stats.snapshot()
+
+    @app.post("/__reset")
+    async def reset_stats():
+        stats.reset()
+        return {"ok": True}
+
+
+#Servidor SMTP minimo: acepta EHLO, AUTH (PLAIN/LOGIN), MAIL, RCPT y DATA y descarta los mensajes
+class SMTPSink:
+    def __init__(self, host: str = "127.0.0.1", port: int = 0):
+        self.host = host
+        self.port = port
+        self.messages = 0
+        self.connections = 0
+        self._loop = None
+        self._server = None
+
+    async def _handle(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        self.connections += 1
+        writer.write(b"220 sink ESMTP\r\n")
+        try:
+            while True:
+                line = await reader.readline()
+                if not line:
+                    break
+                command = line.decode("utf-8", "replace").strip().upper()
+                if command.startswith(("EHLO", "HELO")):
+                    writer.write(b"250-sink\r\n250-AUTH PLAIN LOGIN\r\n250 8BITMIME\r\n")
+                elif command.startswith("AUTH LOGIN"):
+                    writer.write(b"334 " + base64.b64encode(b"Username:") + b"\r\n")
+                    await reader.readline()
+                    writer.write(b"334 " + base64.b64encode(b"Password:") + b"\r\n")
+                    await reader.readline()
+                    writer.write(b"235 autenticado\r\n")
+                elif command.startswith("AUTH"):
+                    writer.write(b"235 autenticado\r\n")
+                elif command == "DATA":
+                    writer.write(b"354 enviar el mensaje\r\n")
+                    await writer.drain()
+                    while (await reader.readline()) not in (b".\r\n", b""):
+                        pass
+                    self.messages += 1
+                    writer.write(b"250 aceptado\r\n")
+                elif command == "QUIT":
+                    writer.write(b"221 adios\r\n")
+                    break
+                else:
+                    writer.write(b"250 ok\r\n")  #MAIL, RCPT, RSET, NOOP
+                await writer.drain()
+        finally:
+            writer.close()
+
+    def start(self):
+        ready = threading.Event()
+
+        def run():
+            self._loop = asyncio.new_event_loop()
+            self._server = self._loop.run_until_complete(asyncio.start_server(self._handle, self.host, self.port))
+            self.port = self._server.sockets[0].getsockname()[1]
+            ready.set()
+            self._loop.run_forever()
+
+        threading.Thread(target=run, daemon=True).start()
+        ready.wait()
+        return self
+
+    def stats(self) -> dict:
+        return {"messages": self.messages, "connections": self.connections}
+
+    def reset(self):
+        self.messages = 0
+        self.connections = 0
+
+    def stop(self):
+        if self._loop is not None:
+            self._loop.call_soon_threadsafe(self._server.close)
+            self._loop.call_soon_threadsafe(self._loop.stop)
+
+
+#levanta una aplicacion ASGI con uvicorn en un hilo; devuelve (servidor, puerto)
+def serve_in_thread(app, port: int = 0):
+    config = uvicorn.Config(app, host="127.0.0.1", port=port, log_level="warning", access_log=False)
+    server = uvicorn.Server(config)
+    threading.Thread(target=server.run, daemon=True).start()
+    while not server.started:
+        time.sleep(0.05)
+    port = server.servers[0].sockets[0].getsockname()[1]
+    return server, port
+
+
+#Inicia los tres servicios falsos y devuelve sus puertos y contadores
+class FakeUpstreams:
+    def __init__(self, siigo_config: SiigoFakeConfig = None, sheet_rows: int = 1000, sheets_latency_ms: float = 100):
+        self.siigo_config = siigo_config or SiigoFakeConfig()
+        self.sheet_rows = sheet_rows
+        self.sheets_latency_ms = sheets_latency_ms
+        self.siigo_stats = CallStats()
+        self.sheets_stats = CallStats()
+        self.smtp = SMTPSink()
+        self._servers = []
+        self.siigo_port = self.sheets_port = None
+
+    def start(self):
+        server, self.siigo_port = serve_in_thread(create_siigo_app(self.siigo_config, self.siigo_stats))
+        self._servers.append(server)
+        server, self.sheets_port = serve_in_thread(create_sheets_app(self.sheet_rows, self.sheets_latency_ms, self.sheets_stats))
+        self._servers.append(server)
+        self.smtp.start()
+        return self
+
+    def reset(self):
+        self.siigo_stats.reset()
+        self.sheets_stats.reset()
+        self.smtp.reset()
+
+    def stop(self):
+        for server in self._servers:
+            server.should_exit = True
+        self.smtp.stop()
+
+    #variables de entorno que apuntan el servicio a los servicios falsos
+    def service_env(self) -> dict:
+        return {
+            "SIIGO_API_URL": f"http://127.0.0.1:{self.siigo_port}",
+            "GOOGLE_SHEETS_ENDPOINT": f"http://127.0.0.1:{self.sheets_port}/",
+            "SMTP_SERVER": "127.0.0.1",
+            "SMTP_PORT": str(self.smtp.port),
+            "SMTP_STARTTLS": "false",
+        }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Servicios falsos de Siigo, Google Sheets y SMTP")
+    parser.add_argument("--siigo-latency-ms", type=float, default=50)
+    parser.add_argument("--siigo-jitter-ms", type=float, default=20)
+    parser.add_argument("--siigo-429-rate", type=float, default=0.0)
+    parser.add_argument("--siigo-error-rate", type=float, default=0.0)
+    parser.add_argument("--siigo-existing-rate", type=float, default=0.0)
+    parser.add_argument("--sheet-rows", type=int, default=1000)
+    parser.add_argument("--sheets-latency-ms", type=float, default=100)
+    args = parser.parse_args()
+
+    config = SiigoFakeConfig(args.siigo_latency_ms, args.siigo_jitter_ms, args.siigo_429_rate,
+                             args.siigo_error_rate, args.siigo_existing_rate)
+    upstreams = FakeUpstreams(config, args.sheet_rows, args.sheets_latency_ms).start()
+    for name, value in upstreams.service_env().items():
+        print(f"{name}={value}")
+    try:
+        while True:
+            time.sleep(3600)
+    except KeyboardInterrupt:
+        upstreams.stop()
+
+
+if __name__ == "__main__":
+    main()
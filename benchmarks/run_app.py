@@ -0,0 +1,53 @@
+#Ejecuta el servicio (mainMejorado3.0.py) para los benchmarks. El nombre del archivo no es un modulo
+#importable, por eso se carga por ruta.
+#
+#uso:
+#   python benchmarks/run_app.py --port 8000        #servidor HTTP con uvicorn
+#   python benchmarks/run_app.py --sync-once        #una sincronizacion completa de la hoja, imprime el reporte en JSON
+import argparse
+import asyncio
+import importlib.util
+import json
+import os
+import sys
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+APP_FILE = os.path.join(ROOT, "mainMejorado3.0.py")
+
+
+def load_app_module():
+    sys.path.insert(0, ROOT)
+    spec = importlib.util.spec_from_file_location("timbale_app", APP_FILE)
+    module = importlib.util.module_from_spec(spec)
+    sys.modules["timbale_app"] = module
+    spec.loader.exec_module(module)
+    return module
+
+
+async def sync_once(module) -> dict:
+    start = time.perf_counter()
+    try:
+        report = await module.process_sheet_data(incremental=False)
+    finally:
+        await module.close_http_client()
+    return {**report.summary(), "wall_seconds": round(time.perf_counter() - start, 3)}
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Servicio de registro para benchmarks")
+    parser.add_argument("--port", type=int, default=8000)
+    parser.add_argument("--sync-once", action="store_true")
+    args = parser.parse_args()
+
+    module = load_app_module()
+    if args.sync_once:
+        print(json.dumps(asyncio.run(sync_once(module))))
+        return
+
+    import uvicorn
+    uvicorn.run(module.app, host="127.0.0.1", port=args.port, log_level="warning", access_log=False)
+
+
+if __name__ == "__main__":
+    main()
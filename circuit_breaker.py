@@ -0,0 +1,90 @@
+#Circuit breaker para las llamadas a servicios externos (Siigo)
+import logging
+import time
+
+logger = logging.getLogger(__name__)
+
+
+class CircuitOpenError(Exception):
+    def __init__(self, name: str, retry_after: float):
+        super().__init__(f"Circuito {name} abierto, reintentar en {retry_after:.0f} s")
+        self.name = name
+        self.retry_after = retry_after
+
+
+#Circuit breaker con estados cerrado, abierto y semiabierto.
+#- cerrado: las llamadas pasan; tras failure_threshold fallas seguidas se abre
+#- abierto: las llamadas fallan de inmediato con CircuitOpenError durante recovery_timeout segundos
+#- semiabierto: se deja pasar hasta half_open_max_calls llamadas de prueba; si salen bien el
+#  circuito se cierra y si alguna falla se vuelve a abrir
+class CircuitBreaker:
+    CLOSED = "closed"
+    OPEN = "open"
+    HALF_OPEN = "half_open"
+
+    def __init__(self, name: str, failure_threshold: int = 5, recovery_timeout: float = 30, half_open_max_calls: int = 1):
+        self.name = name
+        self.failure_threshold = failure_threshold
+        self.recovery_timeout = recovery_timeout
+        self.half_open_max_calls = half_open_max_calls
+        self.consecutive_failures = 0
+        self.opened_total = 0
+        self.rejected_total = 0
+        self._state = self.CLOSED
+        self._opened_at = 0.0
+        self._half_open_calls = 0
+
+    @property
+    def state(self) -> str:
+        if self._state == self.OPEN and time.monotonic() - self._opened_at >= self.recovery_timeout:
+            self._state = self.HALF_OPEN
+            self._half_open_calls = 0
+        return self._state
+
+    def retry_after(self) -> float:
+        return max(0.0, self.recovery_timeout - (time.monotonic() - self._opened_at))
+
+    #se llama antes de cada solicitud; lanza CircuitOpenError si no se permite la llamada
+    def before_call(self):
+        state = self.state
+        if state == self.CLOSED:
+            return
+        if state == self.HALF_OPEN and self._half_open_calls < self.half_open_max_calls:
+            self._half_open_calls += 1
+            return
+        self.rejected_total += 1
+        raise CircuitOpenError(self.name, self.retry_after() or self.recovery_timeout)
+
+    def record_success(self):
+        if self._state != self.CLOSED:
+            logger.info("Circuito %s cerrado, el servicio respondio correctamente", self.name)
+        self._state = self.CLOSED
+        self.consecutive_failures = 0
+        self._half_open_calls = 0
+
+    def record_failure(self):
+        self.consecutive_failures += 1
+        if self._state == self.HALF_OPEN or self.consecutive_failures >= self.failure_threshold:
+            self._open()
+
+    #la llamada se interrumpio sin resultado (por ejemplo se cancelo): libera el turno de prueba
+    def release(self):
+        if self._state == self.HALF_OPEN and self._half_open_calls > 0:
+            self._half_open_calls -= 1
+
+    def _open(self):
+        if self._state != self.OPEN:
+            self.opened_total += 1
+            logger.warning("Circuito %s abierto tras %s fallas seguidas", self.name, self.consecutive_failures)
+        self._state = self.OPEN
+        self._opened_at = time.monotonic()
+        self._half_open_calls = 0
+
+    def stats(self) -> dict:
+        return {
+            "state": self.state,
+            "consecutive_failures": self.consecutive_failures,
+            "opened_total": self.opened_total,
+            "rejected_total": self.rejected_total,
+            "retry_after": round(self.retry_after(), 1) if self._state == self.OPEN else 0,
+        }
@@ -0,0 +1,93 @@
+#Envio de correos con un pool de conexiones SMTP autenticadas
+import asyncio
+import logging
+import queue
+import smtplib
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+logger = logging.getLogger(__name__)
+
+
+#Pool de conexiones SMTP. Mantiene hasta `size` conexiones autenticadas abiertas (STARTTLS + login
+#se hacen una sola vez por conexion) y envia los mensajes en hilos propios para no bloquear el event loop.
+#Las conexiones inactivas por mas de idle_timeout se reemplazan, y si el servidor cerro una conexion
+#el mensaje se reintenta una vez con una conexion nueva.
+class SMTPConnectionPool:
+    def __init__(self, host: str, port: int, username: str, password: str, size: int = 3,
+                 idle_timeout: float = 240, timeout: float = 30, starttls: bool = True):
+        self.host = host
+        self.port = port
+        self.username = username
+        self.password = password
+        self.idle_timeout = idle_timeout
+        self.timeout = timeout
+        self.starttls = starttls
+        self._idle = queue.LifoQueue()  #(conexion, ultimo uso); LIFO reutiliza primero la mas reciente
+        self._executor = ThreadPoolExecutor(max_workers=max(1, size), thread_name_prefix="smtp")
+
+    def _connect(self) -> smtplib.SMTP:
+        server = smtplib.SMTP(self.host, self.port, timeout=self.timeout)
+        try:
+            if self.starttls:
+                server.starttls()
+            if self.username:
+                server.login(self.username, self.password)
+        except Exception:
+            self._quit(server)
+            raise
+        logger.debug("Nueva conexion SMTP abierta con %s:%s", self.host, self.port)
+        return server
+
+    def _quit(self, server: smtplib.SMTP):
+        try:
+            server.quit()
+        except Exception:
+            server.close()
+
+    def _acquire(self) -> smtplib.SMTP:
+        while True:
+            try:
+                server, last_used = self._idle.get_nowait()
+            except queue.Empty:
+                return self._connect()
+            if time.monotonic() - last_used < self.idle_timeout:
+                return server
+            #el servidor probablemente ya cerro la conexion por inactividad
+            self._quit(server)
+
+    def _release(self, server: smtplib.SMTP):
+        self._idle.put((server, time.monotonic()))
+
+    def _send_blocking(self, msg):
+        server = self._acquire()
+        try:
+            try:
+                server.send_message(msg)
+            except (smtplib.SMTPServerDisconnected, ConnectionError):
+                logger.debug("Conexion SMTP cerrada por el servidor, reconectando")
+                server.close()
+                server = self._connect()
+                server.send_message(msg)
+        except Exception:
+            self._quit(server)
+            raise
+        self._release(server)
+
+    async def send(self, msg):
+        loop = asyncio.get_running_loop()
+        await loop.run_in_executor(self._executor, self._send_blocking, msg)
+
+    def _close_blocking(self):
+        while True:
+            try:
+                server, _ = self._idle.get_nowait()
+            except queue.Empty:
+                return
+            self._quit(server)
+
+    #cierra las conexiones abiertas y detiene los hilos del pool
+    async def close(self):
+        loop = asyncio.get_running_loop()
+        await loop.run_in_executor(self._executor, self._close_blocking)
+        self._executor.shutdown(wait=False)
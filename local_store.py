@@ -0,0 +1,341 @@
+#Almacenamiento local en SQLite para datos que el servicio necesita conservar entre reinicios
+import json
+import sqlite3
+import threading
+import time
+import uuid
+
+
+#abre una conexion SQLite compartible entre hilos, con WAL para permitir lecturas concurrentes
+def open_db(path: str) -> sqlite3.Connection:
+    conn = sqlite3.connect(path, check_same_thread=False, timeout=30)
+    conn.execute("PRAGMA journal_mode=WAL")
+    conn.execute("PRAGMA synchronous=NORMAL")
+    return conn
+
+
+#Indice local de identificaciones que ya existen en Siigo.
+#Un acierto dentro del TTL evita la consulta GET /customers?identification=; pasado el TTL
+#la identificacion se vuelve a validar contra Siigo. Solo se guardan resultados positivos.
+class CustomerIndex:
+    def __init__(self, path: str, ttl: float = 7 * 24 * 3600):
+        self.ttl = ttl
+        self._lock = threading.Lock()
+        self._conn = open_db(path)
+        with self._lock, self._conn:
+            self._conn.execute(
+                "CREATE TABLE IF NOT EXISTS siigo_customers ("
+                "identification TEXT PRIMARY KEY, siigo_id TEXT, verified_at REAL NOT NULL)"
+            )
+
+    #True si la identificacion esta en el indice y fue verificada dentro del TTL
+    def is_known(self, identification: str) -> bool:
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT verified_at FROM siigo_customers WHERE identification = ?", (identification,)
+            ).fetchone()
+        return row is not None and time.time() - row[0] < self.ttl
+
+    def add(self, identification: str, siigo_id: str = None):
+        self.add_many([(identification, siigo_id)])
+
+    #items: iterable de tuplas (identification, siigo_id)
+    def add_many(self, items):
+        now = time.time()
+        with self._lock, self._conn:
+            self._conn.executemany(
+                "INSERT INTO siigo_customers (identification, siigo_id, verified_at) VALUES (?, ?, ?) "
+                "ON CONFLICT(identification) DO UPDATE SET "
+                "siigo_id = COALESCE(excluded.siigo_id, siigo_customers.siigo_id), verified_at = excluded.verified_at",
+                [(identification, siigo_id, now) for identification, siigo_id in items if identification],
+            )
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
+
+
+#Huellas (hash del contenido) de las filas de la hoja ya sincronizadas, por identificacion.
+#Permite la sincronizacion incremental: una fila con la misma huella no se envia a Siigo.
+class RowFingerprintStore:
+    def __init__(self, path: str):
+        self._lock = threading.Lock()
+        self._conn = open_db(path)
+        with self._lock, self._conn:
+            self._conn.execute(
+                "CREATE TABLE IF NOT EXISTS sheet_row_fingerprints ("
+                "identification TEXT PRIMARY KEY, fingerprint TEXT NOT NULL, synced_at REAL NOT NULL)"
+            )
+
+    #carga todas las huellas en un diccionario {identification: fingerprint} con una sola consulta
+    def load_all(self) -> dict:
+        with self._lock:
+            return dict(self._conn.execute("SELECT identification, fingerprint FROM sheet_row_fingerprints"))
+
+    #items: iterable de tuplas (identification, fingerprint), se guardan en una sola transaccion
+    def save_many(self, items):
+        now = time.time()
+        with self._lock, self._conn:
+            self._conn.executemany(
+                "INSERT INTO sheet_row_fingerprints (identification, fingerprint, synced_at) VALUES (?, ?, ?) "
+                "ON CONFLICT(identification) DO UPDATE SET fingerprint = excluded.fingerprint, synced_at = excluded.synced_at",
+                [(identification, fingerprint, now) for identification, fingerprint in items],
+            )
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
+
+
+#Cola persistente (outbox) de trabajos de notificacion: correos de bienvenida, mensajes, etc.
+#Los trabajos sobreviven a caidas y reinicios. Un trabajo reclamado queda bloqueado por `lease`
+#segundos; si el proceso muere antes de confirmarlo, vuelve a estar disponible al vencer el bloqueo.
+class Outbox:
+    STATUS_PENDING = "pending"
+    STATUS_SENDING = "sending"
+    STATUS_DONE = "done"
+    STATUS_DEAD = "dead"  #agoto los reintentos
+
+    def __init__(self, path: str, lease: float = 300):
+        self.lease = lease
+        self._lock = threading.Lock()
+        self._conn = open_db(path)
+        with self._lock, self._conn:
+            self._conn.execute(
+                "CREATE TABLE IF NOT EXISTS outbox ("
+                "id INTEGER PRIMARY KEY AUTOINCREMENT, kind TEXT NOT NULL, payload TEXT NOT NULL, "
+                "status TEXT NOT NULL, attempts INTEGER NOT NULL DEFAULT 0, next_attempt_at REAL NOT NULL, "
+                "locked_until REAL, claim TEXT, last_error TEXT, created_at REAL NOT NULL, updated_at REAL NOT NULL)"
+            )
+            self._conn.execute("CREATE INDEX IF NOT EXISTS outbox_due ON outbox (status, next_attempt_at)")
+            #columnas agregadas despues de la primera version de la tabla
+            columns = {row[1] for row in self._conn.execute("PRAGMA table_info(outbox)")}
+            if "result" not in columns:
+                self._conn.execute("ALTER TABLE outbox ADD COLUMN result TEXT")
+            if "dedupe_key" not in columns:
+                self._conn.execute("ALTER TABLE outbox ADD COLUMN dedupe_key TEXT")
+            if "public_id" not in columns:
+                self._conn.execute("ALTER TABLE outbox ADD COLUMN public_id TEXT")
+                self._conn.execute("UPDATE outbox SET public_id = lower(hex(randomblob(16))) WHERE public_id IS NULL")
+            self._conn.execute("CREATE UNIQUE INDEX IF NOT EXISTS outbox_public_id ON outbox (public_id)")
+            #solo puede haber un trabajo activo por (kind, dedupe_key)
+            self._conn.execute(
+                "CREATE UNIQUE INDEX IF NOT EXISTS outbox_active_dedupe ON outbox (kind, dedupe_key) "
+                "WHERE dedupe_key IS NOT NULL AND status IN ('pending', 'sending')"
+            )
+
+    #encola un trabajo y devuelve su id publico (aleatorio, no secuencial: es el que se entrega a los clientes).
+    #Si se indica dedupe_key y ya hay un trabajo activo del mismo tipo con esa clave (por ejemplo un
+    #formulario enviado dos veces) se devuelve el id publico del trabajo existente
+    def enqueue(self, kind: str, payload: dict, dedupe_key: str = None) -> str:
+        now = time.time()
+        public_id = uuid.uuid4().hex
+        with self._lock, self._conn:
+            cursor = self._conn.execute(
+                "INSERT OR IGNORE INTO outbox (kind, payload, status, next_attempt_at, created_at, updated_at, dedupe_key, public_id) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                (kind, json.dumps(payload, ensure_ascii=False), self.STATUS_PENDING, now, now, now, dedupe_key, public_id),
+            )
+            if cursor.rowcount:
+                return public_id
+            return self._conn.execute(
+                "SELECT public_id FROM outbox WHERE kind = ? AND dedupe_key = ? AND status IN (?, ?)",
+                (kind, dedupe_key, self.STATUS_PENDING, self.STATUS_SENDING),
+            ).fetchone()[0]
+
+    #estado de un trabajo del tipo `kind` por su id publico, o None si no existe. Solo el estado: el
+    #contenido y el resultado del trabajo pueden tener datos personales
+    def status(self, public_id: str, kind: str) -> dict:
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT status, attempts, created_at, updated_at FROM outbox WHERE public_id = ? AND kind = ?",
+                (public_id, kind),
+            ).fetchone()
+        if row is None:
+            return None
+        status, attempts, created_at, updated_at = row
+        return {
+            "job_id": public_id,
+            "status": status,
+            "attempts": attempts,
+            "created_at": created_at,
+            "updated_at": updated_at,
+        }
+
+    #reclama hasta `limit` trabajos vencidos; la actualizacion es una sola sentencia, por lo que
+    #varios procesos pueden reclamar a la vez sin tomar el mismo trabajo
+    def claim(self, limit: int = 10) -> list:
+        now = time.time()
+        claim = uuid.uuid4().hex
+        with self._lock, self._conn:
+            self._conn.execute(
+                "UPDATE outbox SET status = ?, claim = ?, locked_until = ?, updated_at = ? WHERE id IN ("
+                "SELECT id FROM outbox WHERE (status = ? AND next_attempt_at <= ?) "
+                "OR (status = ? AND locked_until < ?) ORDER BY next_attempt_at LIMIT ?)",
+                (self.STATUS_SENDING, claim, now + self.lease, now,
+                 self.STATUS_PENDING, now, self.STATUS_SENDING, now, limit),
+            )
+            rows = self._conn.execute(
+                "SELECT id, kind, payload, attempts FROM outbox WHERE claim = ? ORDER BY id", (claim,)
+            ).fetchall()
+        return [
+            {"id": job_id, "kind": kind, "payload": json.loads(payload), "attempts": attempts}
+            for job_id, kind, payload, attempts in rows
+        ]
+
+    def mark_done(self, job_id: int, result: dict = None):
+        with self._lock, self._conn:
+            self._conn.execute(
+                "UPDATE outbox SET status = ?, locked_until = NULL, result = ?, updated_at = ? WHERE id = ?",
+                (self.STATUS_DONE, json.dumps(result, ensure_ascii=False) if result is not None else None, time.time(), job_id),
+            )
+
+    #registra un intento fallido; retry_at=None marca el trabajo como muerto (sin mas reintentos)
+    def mark_failed(self, job_id: int, error: str, retry_at: float = None):
+        status = self.STATUS_PENDING if retry_at is not None else self.STATUS_DEAD
+        with self._lock, self._conn:
+            self._conn.execute(
+                "UPDATE outbox SET status = ?, attempts = attempts + 1, next_attempt_at = COALESCE(?, next_attempt_at), "
+                "locked_until = NULL, last_error = ?, updated_at = ? WHERE id = ?",
+                (status, retry_at, error, time.time(), job_id),
+            )
+
+    def pending_count(self) -> int:
+        with self._lock:
+            return self._conn.execute(
+                "SELECT COUNT(*) FROM outbox WHERE status IN (?, ?)", (self.STATUS_PENDING, self.STATUS_SENDING)
+            ).fetchone()[0]
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
+
+
+#Lease de liderazgo guardado en SQLite. Con varios workers (uvicorn --workers N) sobre la misma base local,
+#solo el que tiene el lease vigente es lider. El lider debe renovarlo antes de `ttl` segundos; si el proceso
+#muere el lease vence y otro worker lo toma
+class LeaderLease:
+    def __init__(self, path: str, name: str, holder: str, ttl: float = 30):
+        self.name = name
+        self.holder = holder
+        self.ttl = ttl
+        self._lock = threading.Lock()
+        self._conn = open_db(path)
+        self._valid_until = 0.0  #reloj monotonic local: hasta cuando es valido el ultimo lease obtenido
+        with self._lock, self._conn:
+            self._conn.execute(
+                "CREATE TABLE IF NOT EXISTS leader_leases ("
+                "name TEXT PRIMARY KEY, holder TEXT NOT NULL, expires_at REAL NOT NULL, acquired_at REAL NOT NULL)"
+            )
+
+    #obtiene o renueva el lease; devuelve True si este proceso es el lider. La sentencia es atomica:
+    #solo actualiza la fila si el lease es propio o ya vencio
+    def try_acquire(self) -> bool:
+        now = time.time()
+        started = time.monotonic()
+        with self._lock, self._conn:
+            self._conn.execute(
+                "INSERT INTO leader_leases (name, holder, expires_at, acquired_at) VALUES (?, ?, ?, ?) "
+                "ON CONFLICT(name) DO UPDATE SET holder = excluded.holder, expires_at = excluded.expires_at, "
+                "acquired_at = CASE WHEN leader_leases.holder = excluded.holder THEN leader_leases.acquired_at ELSE excluded.acquired_at END "
+                "WHERE leader_leases.holder = excluded.holder OR leader_leases.expires_at < ?",
+                (self.name, self.holder, now + self.ttl, now, now),
+            )
+            row = self._conn.execute("SELECT holder FROM leader_leases WHERE name = ?", (self.name,)).fetchone()
+        acquired = row is not None and row[0] == self.holder
+        self._valid_until = started + self.ttl if acquired else 0.0
+        return acquired
+
+    @property
+    def is_leader(self) -> bool:
+        return time.monotonic() < self._valid_until
+
+    #libera el lease si es propio, para que otro worker lo tome sin esperar a que venza
+    def release(self):
+        self._valid_until = 0.0
+        with self._lock, self._conn:
+            self._conn.execute("DELETE FROM leader_leases WHERE name = ? AND holder = ?", (self.name, self.holder))
+
+    def current(self) -> dict:
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT holder, expires_at, acquired_at FROM leader_leases WHERE name = ?", (self.name,)
+            ).fetchone()
+        if row is None:
+            return None
+        holder, expires_at, acquired_at = row
+        return {"holder": holder, "expires_at": expires_at, "acquired_at": acquired_at}
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
+
+
+#Estado persistente de procesos de fondo (por ejemplo la marca de la ultima sincronizacion exitosa),
+#guardado como JSON por nombre
+class SyncStateStore:
+    def __init__(self, path: str):
+        self._lock = threading.Lock()
+        self._conn = open_db(path)
+        with self._lock, self._conn:
+            self._conn.execute(
+                "CREATE TABLE IF NOT EXISTS sync_state (name TEXT PRIMARY KEY, value TEXT NOT NULL, updated_at REAL NOT NULL)"
+            )
+
+    def get(self, name: str) -> dict:
+        with self._lock:
+            row = self._conn.execute("SELECT value FROM sync_state WHERE name = ?", (name,)).fetchone()
+        return json.loads(row[0]) if row else None
+
+    def set(self, name: str, value: dict):
+        with self._lock, self._conn:
+            self._conn.execute(
+                "INSERT INTO sync_state (name, value, updated_at) VALUES (?, ?, ?) "
+                "ON CONFLICT(name) DO UPDATE SET value = excluded.value, updated_at = excluded.updated_at",
+                (name, json.dumps(value, ensure_ascii=False), time.time()),
+            )
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
+
+
+#Estado y progreso de las ejecuciones de la sincronizacion de la hoja, por id de ejecucion. Lo escribe el
+#worker que ejecuta la sincronizacion y lo puede leer cualquier worker. Se conservan las ultimas `keep`
+class SyncRunStore:
+    def __init__(self, path: str, keep: int = 200):
+        self.keep = keep
+        self._lock = threading.Lock()
+        self._conn = open_db(path)
+        with self._lock, self._conn:
+            self._conn.execute(
+                "CREATE TABLE IF NOT EXISTS sync_runs (run_id TEXT PRIMARY KEY, value TEXT NOT NULL, "
+                "created_at REAL NOT NULL, updated_at REAL NOT NULL)"
+            )
+            self._conn.execute("CREATE INDEX IF NOT EXISTS sync_runs_created ON sync_runs (created_at)")
+
+    #ultima foto guardada de la ejecucion, con updated_at (momento en que se guardo), o None
+    def get(self, run_id: str) -> dict:
+        with self._lock:
+            row = self._conn.execute("SELECT value, updated_at FROM sync_runs WHERE run_id = ?", (run_id,)).fetchone()
+        if row is None:
+            return None
+        return {**json.loads(row[0]), "updated_at": row[1]}
+
+    #guarda la ultima foto de una ejecucion (run.to_dict()); al crear una nueva se eliminan las mas antiguas
+    def save(self, run: dict):
+        now = time.time()
+        with self._lock, self._conn:
+            self._conn.execute(
+                "INSERT INTO sync_runs (run_id, value, created_at, updated_at) VALUES (?, ?, ?, ?) "
+                "ON CONFLICT(run_id) DO UPDATE SET value = excluded.value, updated_at = excluded.updated_at",
+                (run["run_id"], json.dumps(run, ensure_ascii=False), run.get("created_at") or now, now),
+            )
+            self._conn.execute(
+                "DELETE FROM sync_runs WHERE run_id NOT IN (SELECT run_id FROM sync_runs ORDER BY created_at DESC LIMIT ?)",
+                (self.keep,),
+            )
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
@@ -0,0 +1,137 @@
+#Configuracion de logging: JSON estructurado, niveles por modulo, muestreo de DEBUG, ocultamiento
+#de secretos y escritura desde un hilo aparte (QueueHandler) para no bloquear el event loop
+import atexit
+import copy
+import json
+import logging
+import logging.handlers
+import queue
+import random
+import re
+import sys
+from datetime import datetime, timezone
+
+
+#claves cuyo valor nunca debe aparecer en los logs
+SECRET_KEYS = ("password", "passwd", "access_key", "access_token", "refresh_token", "client_secret",
+               "authorization", "api_key", "token")
+REDACTED = "***"
+
+#"clave": "valor", 'clave': 'valor', clave=valor y encabezados Bearer
+_SECRET_PATTERN = re.compile(
+    r"""(?P<key>["']?(?:%s)["']?\s*[:=]\s*)(?P<quote>["']?)(?P<value>(?:Bearer\s+)?[^"',}\s&]+)""" % "|".join(SECRET_KEYS),
+    re.IGNORECASE,
+)
+_BEARER_PATTERN = re.compile(r"(Bearer\s+)[A-Za-z0-9\-._~+/]+=*", re.IGNORECASE)
+
+_listener = None
+
+
+def redact(text: str) -> str:
+    text = _SECRET_PATTERN.sub(lambda m: f"{m.group('key')}{m.group('quote')}{REDACTED}", text)
+    return _BEARER_PATTERN.sub(rf"\1{REDACTED}", text)
+
+
+#Una linea JSON por registro. La serializacion y el ocultamiento de secretos se hacen en el hilo del
+#listener; el mensaje ya llega resuelto por QueueHandler.prepare y la excepcion como texto en exc_text
+class JsonFormatter(logging.Formatter):
+    def format(self, record: logging.LogRecord) -> str:
+        entry = {
+            "ts": datetime.fromtimestamp(record.created, timezone.utc).isoformat(timespec="milliseconds"),
+            "level": record.levelname,
+            "logger": record.name,
+            "request_id": getattr(record, "request_id", "-"),
+            "message": redact(record.getMessage()),
+        }
+        if record.exc_info:
+            entry["exception"] = redact(self.formatException(record.exc_info))
+        elif record.exc_text:
+            entry["exception"] = redact(record.exc_text)
+        return json.dumps(entry, ensure_ascii=False, default=str)
+
+
+class RedactingFormatter(logging.Formatter):
+    def format(self, record: logging.LogRecord) -> str:
+        return redact(super().format(record))
+
+
+#QueueHandler.prepare resuelve el mensaje con el Formatter por defecto, que le agrega el traceback, y
+#descarta exc_info. Este prepare resuelve solo el mensaje (los argumentos de logging.debug("...%s", payload)
+#se formatean en el hilo que genera el registro, y solo si paso el nivel y los filtros) y guarda el
+#traceback como texto en exc_text, asi el formatter del listener lo escribe aparte
+class ExceptionQueueHandler(logging.handlers.QueueHandler):
+    _exception_formatter = logging.Formatter()
+
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        record = copy.copy(record)
+        record.message = record.getMessage()
+        record.msg = record.message
+        record.args = None
+        if record.exc_info:
+            record.exc_text = self._exception_formatter.formatException(record.exc_info)
+            record.exc_info = None  #el traceback no se puede enviar entre hilos/procesos con la cola
+        return record
+
+
+#Deja pasar solo una fraccion `rate` de los registros DEBUG; INFO y superiores siempre pasan
+class DebugSamplingFilter(logging.Filter):
+    def __init__(self, rate: float = 1.0):
+        super().__init__()
+        self.rate = rate
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        return record.levelno > logging.DEBUG or self.rate >= 1 or random.random() < self.rate
+
+
+#"httpx=WARNING,siigo_api=DEBUG" -> {"httpx": "WARNING", "siigo_api": "DEBUG"}
+def parse_levels(spec: str) -> dict:
+    levels = {}
+    for item in (spec or "").split(","):
+        if "=" in item:
+            name, level = item.split("=", 1)
+            levels[name.strip()] = level.strip().upper()
+    return levels
+
+
+#Configura el logger raiz. Los registros se encolan en el hilo que los genera (con sus filtros, por
+#ejemplo el id de solicitud, y el mensaje ya resuelto) y un QueueListener los serializa y escribe en la
+#salida estandar
+def setup_logging(level: str = "INFO", fmt: str = "json", module_levels: dict = None,
+                  debug_sample_rate: float = 1.0, filters=()):
+    global _listener
+    stop_logging()
+
+    if fmt == "json":
+        formatter = JsonFormatter()
+    else:
+        formatter = RedactingFormatter("%(asctime)s %(levelname)s [%(request_id)s] %(name)s: %(message)s")
+    stream_handler = logging.StreamHandler(sys.stdout)
+    stream_handler.setFormatter(formatter)
+
+    log_queue = queue.SimpleQueue()
+    queue_handler = ExceptionQueueHandler(log_queue)
+    for log_filter in filters:
+        queue_handler.addFilter(log_filter)
+    queue_handler.addFilter(DebugSamplingFilter(debug_sample_rate))
+
+    root = logging.getLogger()
+    for handler in list(root.handlers):
+        root.removeHandler(handler)
+    root.addHandler(queue_handler)
+    root.setLevel(level.upper())
+    for name, module_level in (module_levels or {}).items():
+        logging.getLogger(name).setLevel(module_level)
+
+    _listener = logging.handlers.QueueListener(log_queue, stream_handler, respect_handler_level=True)
+    _listener.start()
+
+
+#vacia la cola y detiene el hilo de escritura
+def stop_logging():
+    global _listener
+    if _listener is not None:
+        _listener.stop()
+        _listener = None
+
+
+atexit.register(stop_logging)
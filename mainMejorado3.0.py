@@ -5,37 +5,53 @@
 #Webhook: La forma más común de recibir datos de un formulario es a través de un webhook
 #bibliotecas estandar de python
 import json
+import sqlite3
 import smtplib
 from typing import Optional
 import asyncio
-import webbrowser
+from concurrent.futures import ThreadPoolExecutor
 import os
 from email.mime.text import MIMEText
 from email.mime.multipart import MIMEMultipart
 import uuid
 from apscheduler.schedulers.asyncio import AsyncIOScheduler
+from apscheduler.triggers.cron import CronTrigger
+from apscheduler.triggers.interval import IntervalTrigger
 import logging
 import base64
-import traceback
+import threading
+import functools
+import socket
+import time
+from datetime import datetime
 
 
 #bibliotecas de terceros necesarias para el funcionamiento del codigo
 from fastapi import FastAPI, HTTPException, BackgroundTasks, Request
-from fastapi.responses import JSONResponse
+from fastapi import Request as FastAPIRequest  #alias usado por los endpoints que leen la solicitud completa
+from fastapi.responses import JSONResponse, StreamingResponse, Response
+from fastapi.encoders import jsonable_encoder
 from contextlib import asynccontextmanager
-from pydantic import BaseModel
-import gspread
+from pydantic import BaseModel, ValidationError
 import httpx
-from google.oauth2.service_account import Credentials
-from google.oauth2.credentials import Credentials
-from google_auth_oauthlib.flow import Flow
-from googleapiclient.discovery import build
-from google.auth.transport.requests import Request
+#las librerias de Google (google.oauth2, google_auth_oauthlib, googleapiclient, httplib2) se importan dentro
+#de las funciones que las usan: cargarlas aqui agregaba cientos de milisegundos al arranque de cada worker
 import uvicorn
 from dotenv import load_dotenv
 
 #bibliotecas propias del proyecto
-from siigo_api import SiigoAPIError
+from siigo_api import SiigoAPIError, SiigoTokenManager, SiigoRateLimiter, create_http_client
+from retry_policy import RetryPolicy, RetryBudget, RETRYABLE_STATUS, parse_retry_after
+from circuit_breaker import CircuitBreaker, CircuitOpenError
+from single_flight import SingleFlight
+from metrics import MetricsRegistry, observe_duration
+from tracing import RequestIdFilter, request_id_var, new_request_id, setup_tracing, shutdown_tracing, start_span
+from log_config import setup_logging, parse_levels
+from sheet_sync import run_sync, row_fingerprint, row_identification, RowResult, SyncReport, STATUS_CREATED, STATUS_EXISTING, STATUS_FAILED, STATUS_SKIPPED
+from sheet_transform import pad_row, required_column_errors, row_to_siigo_payload, transform_page
+from local_store import CustomerIndex, RowFingerprintStore, Outbox, LeaderLease, SyncStateStore, SyncRunStore
+from sync_scheduler import SyncCoordinator, SyncRun
+from email_sender import SMTPConnectionPool
 from email_error import EmailAPIError
 #from whatsapp import send_whatsapp_message
 
@@ -50,14 +66,66 @@ load_dotenv()   #para importar y manejar las variables de entorno minimizando la
 
 
 #logging.basicConfig(level=logging.INFO)
-logging.basicConfig(level=logging.DEBUG)
+#logging.basicConfig(level=logging.DEBUG)
+#logs en JSON (o texto con LOG_FORMAT=text), escritos desde un hilo aparte y sin secretos
+LOG_LEVEL = os.getenv('LOG_LEVEL', 'INFO')
+LOG_FORMAT = os.getenv('LOG_FORMAT', 'json').lower()
+#niveles por modulo, por ejemplo "siigo_api=DEBUG,httpx=WARNING". Este modulo registra con su nombre de
+#modulo: "__main__" al ejecutarlo directamente (python mainMejorado3.0.py), por ejemplo "__main__=DEBUG"
+LOG_LEVELS = os.getenv('LOG_LEVELS', 'httpx=WARNING,httpcore=WARNING,googleapiclient=WARNING')
+LOG_DEBUG_SAMPLE_RATE = float(os.getenv('LOG_DEBUG_SAMPLE_RATE', 1))  #fraccion de los mensajes DEBUG que se escriben
+setup_logging(LOG_LEVEL, LOG_FORMAT, parse_levels(LOG_LEVELS), LOG_DEBUG_SAMPLE_RATE, filters=[RequestIdFilter()])
+logger = logging.getLogger(__name__)
 
 
 #constantes
 SIIGO_API_URL = os.getenv('SIIGO_API_URL', "https://api.siigo.com")
 SIIGO_AUTH_URL = f"{SIIGO_API_URL}/auth"
 MAX_RETRIES = 3
-RETRY_DELAY = 1
+RETRY_DELAY = 1  #espera base de los reintentos (segundos), crece exponencialmente con jitter
+RETRY_MAX_DELAY = float(os.getenv('RETRY_MAX_DELAY', 30))
+RETRY_BUDGET_RATIO = float(os.getenv('RETRY_BUDGET_RATIO', 0.2))  #reintentos permitidos por cada solicitud original
+RETRY_BUDGET_MIN_PER_SECOND = float(os.getenv('RETRY_BUDGET_MIN_PER_SECOND', 1))
+SIIGO_TOKEN_REFRESH_MARGIN = int(os.getenv('SIIGO_TOKEN_REFRESH_MARGIN', 300))  #segundos antes de expirar en que se renueva el token
+SIIGO_MAX_CONCURRENT_REQUESTS = int(os.getenv('SIIGO_MAX_CONCURRENT_REQUESTS', 5))  #solicitudes simultaneas permitidas hacia Siigo (cuota de la API)
+SIIGO_REQUESTS_PER_MINUTE = float(os.getenv('SIIGO_REQUESTS_PER_MINUTE', 100))  #cuota por minuto publicada por Siigo para la cuenta
+SIIGO_RATE_BURST = int(os.getenv('SIIGO_RATE_BURST', 10))  #solicitudes que se pueden hacer de inmediato tras un periodo inactivo
+#circuit breakers de Siigo: fallas seguidas (5xx o red) para abrir y segundos abierto antes de probar de nuevo
+SIIGO_BREAKER_FAILURE_THRESHOLD = int(os.getenv('SIIGO_BREAKER_FAILURE_THRESHOLD', 5))
+SIIGO_BREAKER_RECOVERY_TIMEOUT = float(os.getenv('SIIGO_BREAKER_RECOVERY_TIMEOUT', 30))
+SIIGO_DEFER_WHEN_OPEN = os.getenv('SIIGO_DEFER_WHEN_OPEN', 'true').lower() == 'true'  #encolar registros mientras Siigo no responde
+#modo asincrono del webhook: se valida y encola el registro y se responde 202 con el id del trabajo
+REGISTRATION_ASYNC = os.getenv('REGISTRATION_ASYNC', 'false').lower() == 'true'
+BATCH_CONCURRENCY = int(os.getenv('BATCH_CONCURRENCY', 5))  #registros de /register-batch procesados en paralelo
+SYNC_WORKERS = int(os.getenv('SYNC_WORKERS', 5))  #filas de la hoja procesadas en paralelo
+SYNC_ROW_TIMEOUT = int(os.getenv('SYNC_ROW_TIMEOUT', 120))  #segundos maximos para procesar una fila
+SYNC_INCREMENTAL = os.getenv('SYNC_INCREMENTAL', 'true').lower() == 'true'  #solo enviar a Siigo filas nuevas o modificadas
+#configuracion del cliente HTTP compartido (pool de conexiones hacia Siigo)
+HTTP_MAX_CONNECTIONS = int(os.getenv('HTTP_MAX_CONNECTIONS', 20))
+HTTP_MAX_KEEPALIVE_CONNECTIONS = int(os.getenv('HTTP_MAX_KEEPALIVE_CONNECTIONS', 10))
+HTTP_KEEPALIVE_EXPIRY = float(os.getenv('HTTP_KEEPALIVE_EXPIRY', 30))  #segundos que una conexion inactiva se mantiene abierta
+HTTP_TIMEOUT = float(os.getenv('HTTP_TIMEOUT', 30))
+HTTP_CONNECT_TIMEOUT = float(os.getenv('HTTP_CONNECT_TIMEOUT', 10))
+HTTP2_ENABLED = os.getenv('HTTP2_ENABLED', 'false').lower() == 'true'
+#base de datos local (SQLite) e indice de clientes que ya existen en Siigo
+LOCAL_DB_PATH = os.getenv('LOCAL_DB_PATH', 'timbale_local.db')
+CUSTOMER_INDEX_TTL = int(os.getenv('CUSTOMER_INDEX_TTL', 7 * 24 * 3600))  #segundos antes de revalidar una identificacion contra Siigo
+CUSTOMER_INDEX_BULK_LOAD = os.getenv('CUSTOMER_INDEX_BULK_LOAD', 'true').lower() == 'true'
+CUSTOMER_INDEX_REFRESH_HOURS = int(os.getenv('CUSTOMER_INDEX_REFRESH_HOURS', 24))
+CUSTOMER_INDEX_PAGE_SIZE = int(os.getenv('CUSTOMER_INDEX_PAGE_SIZE', 100))  #maximo permitido por Siigo
+#con varios workers solo el lider (lease en LOCAL_DB_PATH) ejecuta las tareas programadas
+LEADER_ELECTION = os.getenv('LEADER_ELECTION', 'true').lower() == 'true'
+LEADER_LEASE_TTL = float(os.getenv('LEADER_LEASE_TTL', 30))  #segundos; el lider renueva el lease cada tercio de este tiempo
+#programacion de la sincronizacion de la hoja: cada SHEET_SYNC_INTERVAL_MINUTES o, si se define, segun una
+#expresion cron (por ejemplo "*/30 7-21 * * 1-6" para sincronizar solo en horario laboral)
+SHEET_SYNC_INTERVAL_MINUTES = int(os.getenv('SHEET_SYNC_INTERVAL_MINUTES', 30))
+SHEET_SYNC_CRON = os.getenv('SHEET_SYNC_CRON')
+SHEET_SYNC_MISFIRE_GRACE = int(os.getenv('SHEET_SYNC_MISFIRE_GRACE', 300))  #segundos de retraso tolerados para una ejecucion programada
+#al iniciar, sincronizar de inmediato si la ultima sincronizacion exitosa es mas antigua que el intervalo
+SHEET_SYNC_CATCH_UP = os.getenv('SHEET_SYNC_CATCH_UP', 'true').lower() == 'true'
+SYNC_PROGRESS_INTERVAL = float(os.getenv('SYNC_PROGRESS_INTERVAL', 1))  #segundos entre lineas de progreso de /process-sheet/{run_id}
+#una ejecucion en curso cuyo progreso no se actualiza en este tiempo se da por perdida (el worker que la ejecutaba se detuvo)
+SYNC_RUN_STALE_SECONDS = float(os.getenv('SYNC_RUN_STALE_SECONDS', 60))
 # Google Sheets setup
 SCOPES = ['https://www.googleapis.com/auth/spreadsheets.readonly', 'https://www.googleapis.com/auth/drive']
 GOOGLE_CREDS_PATH = os.getenv('GOOGLE_CREDS_PATH')
@@ -66,14 +134,58 @@ SMTP_SERVER = os.getenv('SMTP_SERVER')
 SMTP_PORT = int(os.getenv('SMTP_PORT'))
 SMTP_USERNAME = os.getenv('SMTP_USERNAME')
 SMTP_PASSWORD = os.getenv('SMTP_PASSWORD')
+SMTP_POOL_SIZE = int(os.getenv('SMTP_POOL_SIZE', 3))  #conexiones SMTP autenticadas que se mantienen abiertas
+SMTP_IDLE_TIMEOUT = int(os.getenv('SMTP_IDLE_TIMEOUT', 240))  #segundos de inactividad antes de reemplazar una conexion
+SMTP_STARTTLS = os.getenv('SMTP_STARTTLS', 'true').lower() == 'true'
+#outbox de notificaciones (correos de bienvenida) procesada por workers en segundo plano
+OUTBOX_WORKERS = int(os.getenv('OUTBOX_WORKERS', 2))
+OUTBOX_MAX_ATTEMPTS = int(os.getenv('OUTBOX_MAX_ATTEMPTS', 8))
+OUTBOX_RETRY_BASE_DELAY = float(os.getenv('OUTBOX_RETRY_BASE_DELAY', 30))  #segundos, se duplica en cada intento
+OUTBOX_RETRY_MAX_DELAY = float(os.getenv('OUTBOX_RETRY_MAX_DELAY', 3600))
+OUTBOX_POLL_INTERVAL = float(os.getenv('OUTBOX_POLL_INTERVAL', 5))
+#lectura paginada de la hoja: filas por ventana y ventanas por cada solicitud batchGet
+SHEET_NAME = os.getenv('SHEET_NAME')  #si no se define se usa la primera hoja
+SHEET_LAST_COLUMN = os.getenv('SHEET_LAST_COLUMN', 'AE')
+SHEET_WINDOW_ROWS = int(os.getenv('SHEET_WINDOW_ROWS', 500))
+SHEET_WINDOWS_PER_REQUEST = int(os.getenv('SHEET_WINDOWS_PER_REQUEST', 4))
+GOOGLE_IO_THREADS = int(os.getenv('GOOGLE_IO_THREADS', 4))  #hilos dedicados a las llamadas bloqueantes de googleapiclient
+GOOGLE_SHEETS_ENDPOINT = os.getenv('GOOGLE_SHEETS_ENDPOINT')  #solo para pruebas: servidor local que imita la API de Sheets
+#permite el flujo OAuth interactivo (navegador / codigo por consola) cuando no hay token.json valido;
+#en el servidor debe quedar en false para que un token vencido falle en lugar de bloquear el proceso
+GOOGLE_INTERACTIVE_AUTH = os.getenv('GOOGLE_INTERACTIVE_AUTH', 'false').lower() == 'true'
+WARMUP_RETRY_INTERVAL = float(os.getenv('WARMUP_RETRY_INTERVAL', 30))  #segundos entre intentos de precarga fallidos
+#trazas OpenTelemetry: "console", "file" (una linea JSON por span en TRACING_FILE) o "none"
+TRACING_EXPORTER = os.getenv('TRACING_EXPORTER', 'none').lower()
+TRACING_FILE = os.getenv('TRACING_FILE', 'timbale_traces.jsonl')
+
+#metricas de rendimiento expuestas en /metrics (formato de texto de Prometheus)
+metrics = MetricsRegistry()
+http_request_seconds = metrics.histogram(
+    "timbale_http_request_duration_seconds", "Duracion de las solicitudes recibidas por el servicio", ("endpoint", "method", "status"))
+http_requests_in_flight = metrics.gauge("timbale_http_requests_in_flight", "Solicitudes HTTP en curso")
+siigo_request_seconds = metrics.histogram(
+    "timbale_siigo_request_duration_seconds", "Duracion de cada llamada a la API de Siigo", ("endpoint", "method", "status"))
+siigo_requests_in_flight = metrics.gauge("timbale_siigo_requests_in_flight", "Llamadas a Siigo en curso")
+sheets_request_seconds = metrics.histogram(
+    "timbale_sheets_request_duration_seconds", "Duracion de cada llamada a la API de Google Sheets", ("operation", "status"))
+smtp_send_seconds = metrics.histogram("timbale_smtp_send_duration_seconds", "Duracion de cada envio de correo por SMTP", ("status",))
+registrations_total = metrics.counter("timbale_registrations_total", "Registros procesados por resultado", ("status",))
+sheet_rows_total = metrics.counter("timbale_sheet_sync_rows_total", "Filas de la hoja procesadas por resultado", ("status",))
+registrations_in_flight = metrics.gauge("timbale_registrations_in_flight", "Registros distintos en curso hacia Siigo")
+outbox_queue_depth = metrics.gauge("timbale_outbox_pending_jobs", "Trabajos pendientes o en envio en la outbox")
+siigo_rate_limit_headroom = metrics.gauge(
+    "timbale_siigo_rate_limit_headroom", "Solicitudes a Siigo que se pueden hacer ahora sin esperar al limitador de tasa")
+siigo_rate_limit_rate = metrics.gauge(
+    "timbale_siigo_rate_limit_requests_per_minute", "Tasa actual del limitador de solicitudes a Siigo (se reduce ante 429)")
+siigo_throttled_total = metrics.counter("timbale_siigo_throttled_total", "Respuestas 429 recibidas de Siigo")
+siigo_breaker_state = metrics.gauge(
+    "timbale_siigo_breaker_state", "Estado del circuit breaker por endpoint de Siigo (0 cerrado, 1 semiabierto, 2 abierto)", ("endpoint",))
+siigo_breaker_opened_total = metrics.counter(
+    "timbale_siigo_breaker_opened_total", "Veces que se abrio el circuit breaker por endpoint de Siigo", ("endpoint",))
+siigo_breaker_rejected_total = metrics.counter(
+    "timbale_siigo_breaker_rejected_total", "Llamadas a Siigo rechazadas por el circuit breaker abierto", ("endpoint",))
 
 
-# Configura el flujo de OAuth 2.0
-flow = Flow.from_client_secrets_file(
-    'credentials/client_secrets.json',
-    scopes=['https://www.googleapis.com/auth/spreadsheets.readonly']
-)
-
 def validate_env_vars():  #funcion para validar las variables de entorno
     required_vars = [
         'SIIGO_API_URL', 'SIIGO_PARTNER_ID', 'SIIGO_API_USERNAME',
@@ -84,12 +196,18 @@ def validate_env_vars():  #funcion para validar las variables de entorno
     missing_vars = [var for var in required_vars if not os.getenv(var)]
     if missing_vars:
         raise ValueError(f"Faltan las siguientes variables de entorno: {', '.join(missing_vars)}")
-    print("Todas las variables de entorno requeridas están configuradas.")
+    logger.info("Todas las variables de entorno requeridas están configuradas.")
 
-validate_env_vars()
+#sin token valido y sin GOOGLE_INTERACTIVE_AUTH no se abre el flujo OAuth (input() bloquearia el worker)
+def require_interactive_auth():
+    if not GOOGLE_INTERACTIVE_AUTH:
+        raise RuntimeError("No hay un token de Google valido en token.json; ejecute la autorizacion con GOOGLE_INTERACTIVE_AUTH=true")
 
 # Función para obtener credenciales OAuth 2.0
 def get_oauth2_creds():
+    from google.oauth2.credentials import Credentials
+    from google.auth.transport.requests import Request
+    from google_auth_oauthlib.flow import Flow
     creds = None
     if os.path.exists('token.json'):
         creds = Credentials.from_authorized_user_file('token.json', SCOPES)
@@ -98,6 +216,7 @@ def get_oauth2_creds():
         if creds and creds.expired and creds.refresh_token:
             creds.refresh(Request())
         else:
+            require_interactive_auth()
             flow = Flow.from_client_secrets_file(
                 'credentials/client_secrets.json',
                 scopes=SCOPES
@@ -119,48 +238,57 @@ def get_oauth2_creds():
     return creds
 
 # Usar OAuth 2.0 o credenciales de cuenta de servicio según sea necesario
-creds = get_oauth2_creds() if os.path.exists('credentials/client_secrets.json') else Credentials.from_service_account_file(GOOGLE_CREDS_PATH, scopes=SCOPES)
-
-#crea los clientes de Google Sheets y Gmail
-sheets_service = build('sheets', 'v4', credentials=creds)
-gmail_service = build('gmail', 'v1', credentials=creds)
-lock= asyncio.Lock()
-
-def get_new_token():
-    creds = None
-    # El archivo token.json almacena los tokens de acceso y actualización del usuario
-    if os.path.exists('token.json'):
-        creds = Credentials.from_authorized_user_file('token.json', SCOPES)
-    
-    # Si no hay credenciales válidas disponibles, permite que el usuario inicie sesión.
-    if not creds or not creds.valid:
-        if creds and creds.expired and creds.refresh_token:
-            creds.refresh(Request())
-        else:
-            flow = Flow.from_client_secrets_file(
-                'credentials/client_secrets.json',
-                scopes=SCOPES
-            )
-            flow.run_local_server(port=8080)
-            
-            authorization_url, _ = flow.authorization_url(prompt='consent')
-            print(f'Por favor, visita esta URL para autorizar la aplicación: {authorization_url}')
-
-            code = input('Ingresa el código de autorización: ')
-            flow.fetch_token(code=code)
-            creds = flow.credentials
-        # Guarda las credenciales para la próxima ejecución
-        with open('token.json', 'w') as token:
-            token.write(creds.to_json())
-    
-    return creds.token
-
-# Obtener el token
-access_token = get_new_token()
-print(f"Tu token de acceso es: {access_token}")
-
-# Usa esta función para obtener nuevas credenciales
-creds = get_new_token()
+def load_google_creds():
+    from google.oauth2 import service_account
+    if os.path.exists('credentials/client_secrets.json'):
+        return get_oauth2_creds()
+    return service_account.Credentials.from_service_account_file(GOOGLE_CREDS_PATH, scopes=SCOPES)
+
+#las credenciales se cargan en el primer uso (get_google_service) o en la precarga de lifespan
+creds = None
+
+#servicios de Google construidos una sola vez por credencial: (nombre, version) -> (credenciales, servicio)
+google_services = {}
+google_services_lock = threading.Lock()
+google_http = threading.local()  #conexion httplib2 propia de cada hilo, httplib2 no es thread-safe
+
+#Devuelve el servicio de Google en cache. Se construye con el documento de descubrimiento incluido en
+#googleapiclient (static_discovery), sin consultas de red, y solo se reconstruye si las credenciales cambian.
+#Cada solicitud usa la conexion del hilo que la ejecuta, asi el mismo servicio se comparte entre hilos.
+def get_google_service(name: str, version: str):
+    from googleapiclient.discovery import build
+    from googleapiclient.http import HttpRequest
+    import google_auth_httplib2
+    import httplib2
+    global creds
+    if creds is None:
+        logger.debug("Obteniendo nuevas credenciales")
+        creds = load_google_creds()
+
+    with google_services_lock:
+        cached = google_services.get((name, version))
+        if cached and cached[0] is creds:
+            return cached[1]
+
+        service_creds = creds
+
+        def build_request(http, *args, **kwargs):
+            if not hasattr(google_http, 'http'):
+                google_http.http = httplib2.Http()
+            authorized_http = google_auth_httplib2.AuthorizedHttp(service_creds, http=google_http.http)
+            return HttpRequest(authorized_http, *args, **kwargs)
+
+        logger.debug("Construyendo el servicio de Google %s %s", name, version)
+        service = build(
+            name, version,
+            http=google_auth_httplib2.AuthorizedHttp(service_creds, http=httplib2.Http()),
+            requestBuilder=build_request,
+            static_discovery=True,
+            cache_discovery=False,
+            client_options={"api_endpoint": GOOGLE_SHEETS_ENDPOINT} if name == 'sheets' and GOOGLE_SHEETS_ENDPOINT else None,
+        )
+        google_services[(name, version)] = (service_creds, service)
+        return service
 
 #  Modelo Pydantic para datos de registro de usuario
 class UserRegistration(BaseModel):
@@ -172,6 +300,13 @@ class UserRegistration(BaseModel):
     address: Optional[str] = ""
     city: Optional[str] = ""
 
+#opciones de /process-sheet
+class SheetSyncRequest(BaseModel):
+    start_row: Optional[int] = None
+    end_row: Optional[int] = None
+    identifications: Optional[list[str]] = None
+    full: bool = False
+
 app= FastAPI()
 
 
@@ -182,137 +317,195 @@ def create_headers(token: str) -> dict:
         "Partner-Id": os.getenv('SIIGO_PARTNER_ID')  # Asegúrate de tener el Partner-ID en tus variables de entorno
     
     }
-#funcion para leer los datos de la hoja de calculo  de Google Sheets
-async def read_sheet_data(range: str = 'A1:AE100'):
+#pool de hilos acotado para googleapiclient: build() y execute() son bloqueantes y no deben
+#ejecutarse en el event loop, porque detienen los webhooks mientras dura una lectura de la hoja
+google_io_executor = ThreadPoolExecutor(max_workers=GOOGLE_IO_THREADS, thread_name_prefix="google-io")
+
+async def run_google_io(func, *args):
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(google_io_executor, func, *args)
+
+#llamada a la API de Sheets en el pool de hilos, con la politica de reintentos de Google
+async def run_sheets_request(func, *args):
+    return await sheets_retry.run(lambda: timed_sheets_request(func, *args))
+
+async def timed_sheets_request(func, *args):
+    with start_span(f"sheets.{func.__name__}"), \
+            observe_duration(sheets_request_seconds, operation=func.__name__, status="error") as labels:
+        result = await run_google_io(func, *args)
+        labels["status"] = "ok"
+    return result
+
+#devuelve el servicio de Google Sheets en cache; googleapiclient renueva solo las credenciales vencidas
+def get_sheets_service():
+    return get_google_service('sheets', 'v4')
+
+#numero de filas de la hoja (SHEET_NAME o la primera hoja del documento)
+def fetch_sheet_row_count(service) -> int:
+    metadata = service.spreadsheets().get(
+        spreadsheetId=SHEET_ID,
+        fields="sheets(properties(title,gridProperties(rowCount)))"
+    ).execute()
+    sheets = metadata.get('sheets', [])
+    for sheet in sheets:
+        properties = sheet.get('properties', {})
+        if not SHEET_NAME or properties.get('title') == SHEET_NAME:
+            return properties.get('gridProperties', {}).get('rowCount', 0)
+    raise ValueError(f"No se encontro la hoja {SHEET_NAME} en el documento {SHEET_ID}")
+
+def fetch_sheet_ranges(service, ranges: list) -> list:
+    result = service.spreadsheets().values().batchGet(spreadsheetId=SHEET_ID, ranges=ranges).execute()
+    return result.get('valueRanges', [])
+
+def sheet_window_range(start_row: int, end_row: int) -> str:
+    window = f"A{start_row}:{SHEET_LAST_COLUMN}{end_row}"
+    return f"'{SHEET_NAME}'!{window}" if SHEET_NAME else window
+
+#Generador asincrono que lee la hoja por ventanas de window_rows filas y entrega cada ventana (pagina) como
+#(numero de la primera fila, filas) a medida que llegan. Cada solicitud batchGet trae windows_per_request
+#ventanas y la siguiente solicitud se descarga mientras se consumen las paginas de la actual.
+#start_row y end_row limitan la lectura a un rango de filas de la hoja (ambos incluidos)
+async def iter_sheet_pages(window_rows: int = SHEET_WINDOW_ROWS, windows_per_request: int = SHEET_WINDOWS_PER_REQUEST,
+                           start_row: int = 1, end_row: int = None):
+    service = await run_google_io(get_sheets_service)
+    total_rows = await run_sheets_request(fetch_sheet_row_count, service)
+    last_row = min(end_row, total_rows) if end_row else total_rows
+    logger.debug("Leyendo las filas %s a %s de la hoja %s en ventanas de %s", start_row, last_row, SHEET_ID, window_rows)
+
+    window_starts = list(range(start_row, last_row + 1, window_rows))
+    windows = [sheet_window_range(start, min(start + window_rows - 1, last_row)) for start in window_starts]
+    batches = [windows[i:i + windows_per_request] for i in range(0, len(windows), windows_per_request)]
+    if not batches:
+        return
+
+    pending = asyncio.create_task(run_sheets_request(fetch_sheet_ranges, service, batches[0]))
     try:
-        global creds
-        if not creds or not creds.valid:
-            logging.debug("Obteniendo nuevas credenciales")
-            creds = get_new_token()
-
-        logging.debug(f"Usando credenciales: {creds}")
-        service = build('sheets', 'v4', credentials=creds)
-        sheet = service.spreadsheets()
-        logging.debug(f"Intentando leer hoja {SHEET_ID}, rango {range}")
-        result = sheet.values().get(spreadsheetId=SHEET_ID, range=range).execute() 
-        logging.debug(f"Resultado obtenido: {result}")
-        return result.get('values', [])
-    except HTTPException as err:
-        logging.error(f"Error de la API: {err}", exc_info=True)
-        print(f"Se produjo un error: {err}")
-        if err.status_code == 401:
-            print(f'Error de autenticacion. intentando renovar el token...')
-            creds = get_new_token()
-            return await read_sheet_data(range) #intento de nuevo con el token renovado
-    except Exception as e:
-        print(f'Error al leer los datos de la hoja de calculo: {str(e)}')
-        raise 
+        for index in range(len(batches)):
+            value_ranges = await pending
+            if index + 1 < len(batches):
+                pending = asyncio.create_task(run_sheets_request(fetch_sheet_ranges, service, batches[index + 1]))
+            first_window = index * windows_per_request
+            for offset, value_range in enumerate(value_ranges):
+                yield window_starts[first_window + offset], value_range.get('values', [])
+    finally:
+        if not pending.done():
+            pending.cancel()
 
 #Antes de realizar la transformacion de los datos a un formato que SIIGO pueda recibir, hay que validar si estos datos almenos en los campos obligatorios para SIIGO, si contengan informacion
+#(las columnas obligatorias estan en sheet_transform.REQUIRED_COLUMNS; la sincronizacion valida paginas completas con transform_page)
 def validate_row_data(row):
-    if not row[0]:  # Identificación
-        raise ValueError("La identificación es obligatoria.")
-    if not row[3] or not row[4]:  # Nombres y Apellidos
-        raise ValueError("Los nombres y apellidos son obligatorios.")
-    if not row[4]:
-        raise ValueError("El tipo de Cliente es Obligatorio.")
-    if not row[5]:
-        raise ValueError("La Razon Social es Obligatoria.")
-    # Agrega más validaciones según sea necesario
-
-#funcion para transformar los datos de la hoja de calculo en un formato util para el registro de usuarios en Siigo
+    error = required_column_errors([[cell] for cell in pad_row(row)])[0]
+    if error:
+        raise ValueError(error)
+
+#funcion para transformar una fila de la hoja de calculo en un formato util para el registro de usuarios en Siigo
+#las filas cortas se completan con celdas vacias en lugar de fallar con IndexError
 def transform_sheet_data_to_siigo_format(row):
-    try:    # vamos a crear un diccionario con el formato requerido por SIIGO
-        siigo_data = { 
-        "type": "Customer",
-        "person_type": "Person",
-        "id_type": "13",  # Asumimos que siempre es 13, ajusta si es necesario
-        "identification": row[0],  # Número de identificación
-        "check_digit": "7",  # Este valor se ajusta si es necesario
-        "name": [
-            row[6],  # Nombre
-            row[7]   # Apellido
-        ],
-        "commercial_name": f"{row[6]} {row[7]}",  # Usamos nombre y apellido como nombre comercial
-        "branch_office": 0,
-        "active": row[30].lower() != "inactivo",  # Activo si no es "Inactivo"
-        "vat_responsible": row[16] != "0 - No responsable de IVA",  # Responsable de IVA si no es "0 - No responsable de IVA"
-        "fiscal_responsibilities": [
-            {
-                "code": "R-99-PN"  # se ajusta si es necesario
-            }
-        ],
-        "address": {
-            "address": row[9],  # Dirección
-            "city": {
-                "country_code": "Co",
-                "state_code": "19",  # se ajusta si es necesario
-                "city_code": "19001"
-            },
-            "postal_code": "110111"  # se ajusta si es necesario
-        },
-        "phones": [
-            {
-                "indicative": "57",
-                "number": row[14],  # Número de teléfono
-                "extension": ""
-            }
-        ],
-        "contacts": [
-            {
-                "first_name": row[6],  # Usamos el mismo nombre del cliente
-                "last_name": row[7],   # Usamos el mismo apellido del cliente
-                "email": row[24],      # Email
-                "phone": {
-                    "indicative": "57",
-                    "number": row[14],  # Mismo número de teléfono
-                    "extension": ""
-                }
-            }
-        ],
-        "comments": "",
-        "related_users": [],
-        "seller": None,
-        "assigned_user": None,
-        "account_group": None,
-        "custom_fields": []
-    }
-        return siigo_data
-    except IndexError as e:
-        logging.error(f"Error al acceder a los índices de la fila: {str(e)}")
-        raise ValueError("Fila incompleta o mal estructurada.")
+    return row_to_siigo_payload(pad_row(row))
+
+#Etapa de validacion y transformacion por lotes: cada pagina de la hoja se valida y transforma completa con
+#transform_page. Las filas invalidas quedan como fallidas en el reporte sin llegar a los workers y las validas
+#siguen con su cuerpo para Siigo ya calculado. identifications limita las filas a sincronizar
+async def prepare_sheet_rows(pages, report: SyncReport, identifications: set = None):
+    async for first_row, page in pages:
+        row_numbers = [first_row + offset for offset, row in enumerate(page) if row]  #las filas vacias se omiten
+        rows = [row for row in page if row]
+        if identifications:
+            selected = [index for index, row in enumerate(rows) if row_identification(row) in identifications]
+            rows = [rows[index] for index in selected]
+            row_numbers = [row_numbers[index] for index in selected]
+
+        transformed = transform_page(rows, row_numbers)
+        report.rows_read += transformed.error_count()
+        for record in transformed.error_records():
+            logger.warning("Fila %s (%s) invalida: %s", record["row"], record["identification"], record["error"])
+            report.add(RowResult(record["row"], record["identification"], STATUS_FAILED, record["error"]))
+        for row in transformed.rows:
+            yield row
+
+#funcion para sincronizar una fila de la hoja con Siigo, devuelve el estado de la fila (created / existing / skipped)
+#known_fingerprints: huellas de la ultima sincronizacion; si la fila no cambio no se hace ninguna llamada a Siigo
+#pending_fingerprints: huellas de las filas ya sincronizadas que aun no se guardan (ver flush_row_fingerprints)
+async def sync_sheet_row(row, client: httpx.AsyncClient, known_fingerprints: dict = None,
+                         pending_fingerprints: list = None) -> str:
+    identification = row_identification(row)
+    fingerprint = row_fingerprint(row)
+    if known_fingerprints is not None and identification and known_fingerprints.get(identification) == fingerprint:
+        return STATUS_SKIPPED
+
+    status = await sync_sheet_row_to_siigo(row, client)
+    if identification:
+        #solo se guarda si la fila se sincronizo sin errores
+        if pending_fingerprints is None:
+            await asyncio.to_thread(row_fingerprints.save_many, [(identification, fingerprint)])
+        else:
+            pending_fingerprints.append((identification, fingerprint))
+            await flush_row_fingerprints(pending_fingerprints)
+    return status
+
+#guarda las huellas pendientes en SQLite fuera del event loop, en una sola transaccion por lote; sin force
+#solo se escribe cuando el lote llega a SHEET_WINDOW_ROWS filas (una pagina de la hoja)
+async def flush_row_fingerprints(pending: list, force: bool = False):
+    if not pending or (len(pending) < SHEET_WINDOW_ROWS and not force):
+        return
+    batch = pending[:]
+    del pending[:]
+    await asyncio.to_thread(row_fingerprints.save_many, batch)
+
+async def sync_sheet_row_to_siigo(row, client: httpx.AsyncClient) -> str:
+    # las filas que vienen de prepare_sheet_rows ya estan validadas y traen el cuerpo para Siigo
+    siigo_data = getattr(row, "siigo_payload", None)
+    if siigo_data is None:
+        validate_row_data(row)
+        siigo_data = transform_sheet_data_to_siigo_format(row)
+
+    # Validación de existencia del cliente en Siigo
+    if await check_customer_exists(siigo_data['identification'], client):
+        logger.info("El Usuario %s ya existe en Siigo, No es Necesario el Registro.", siigo_data['identification'])
+        return STATUS_EXISTING
+
+    # Si no existe, se crea el cliente en Siigo
+    await create_siigo_customer(siigo_data, client)
+    logger.info("Cliente %s registrado exitosamente en Siigo.", siigo_data['identification'])
+    return STATUS_CREATED
 
 # Función para procesar los datos de la hoja de cálculo de Google Sheets
-async def process_sheet_data():
-    async with httpx.AsyncClient() as client:
-        rows = await read_sheet_data()  # Leer los datos de la hoja
-        token = await get_siigo_token(client)  # Obtención del token Siigo
-
-        for row in rows:
-            try:
-                # Verificar que la fila tenga los campos necesarios
-                if len(row) < 5:
-                    logging.warning(f"Fila incompleta: {row}")
-                    continue
-
-                # Transformar los datos de la fila al formato requerido por Siigo
-                siigo_data = transform_sheet_data_to_siigo_format(row)
-
-                # Validación de existencia del cliente en Siigo
-                if not await check_customer_exists(siigo_data['identification'], token, client):
-                    # Si no existe, se crea el cliente en Siigo
-                    siigo_response = await create_siigo_customer(siigo_data, token, client)
-
-                    if siigo_response['status'] == 'new':
-                        logging.info(f"Cliente {siigo_data['identification']} registrado exitosoen Siigo.")
-                else:
-                    logging.info(f"El Usuario {siigo_data['identification']} ya existe en Siigo, No es Necesario el Registro.")
-            except Exception as e:
-                logging.error(f"Error procesando la fila {row}: {str(e)}")
-
-
-#funcion para obtener el token de acceso de Siigo basado en el token brindado por la gente de soporte de siigo
-async def get_siigo_token(client: httpx.AsyncClient) -> str:
+# las filas se reparten entre SYNC_WORKERS workers concurrentes y el resultado de cada fila queda en el reporte
+# en modo incremental las filas sin cambios desde la ultima sincronizacion se omiten (skipped)
+# start_row / end_row limitan el rango de filas y identifications las filas a sincronizar; si se pasa un
+# report, el progreso se puede consultar mientras la sincronizacion avanza
+async def process_sheet_data(incremental: bool = SYNC_INCREMENTAL, start_row: int = 1, end_row: int = None,
+                             identifications: list = None, report: SyncReport = None):
+    client = get_http_client()
+    known_fingerprints = await asyncio.to_thread(row_fingerprints.load_all) if incremental else None
+    pending_fingerprints = []
+    report = report or SyncReport()
+    pages = iter_sheet_pages(start_row=start_row, end_row=end_row)
+    rows = prepare_sheet_rows(pages, report, set(identifications) if identifications else None)
+
+    #las filas se procesan a medida que se descargan y transforman las paginas de la hoja
+    with start_span("sheet_sync", **{"sync.incremental": incremental}) as span:
+        try:
+            report = await run_sync(
+                rows,
+                lambda row: sync_sheet_row(row, client, known_fingerprints, pending_fingerprints),
+                workers=SYNC_WORKERS,
+                row_timeout=SYNC_ROW_TIMEOUT,
+                report=report,
+            )
+        finally:
+            #las filas ya sincronizadas se guardan aunque la sincronizacion termine con error
+            await flush_row_fingerprints(pending_fingerprints, force=True)
+        for status, count in report.counts.items():
+            span.set_attribute(f"sync.rows.{status}", count)
+    for status, count in report.counts.items():
+        sheet_rows_total.inc(count, status=status)
+    logger.info("Sincronizacion de la hoja finalizada: %s", report.summary())
+    return report
+
+
+#funcion para solicitar un token nuevo a Siigo basado en el token brindado por la gente de soporte de siigo
+async def fetch_siigo_token(client: httpx.AsyncClient) -> dict:
     headers = {
         "Content-Type": "application/json",
         "Partner-Id": os.getenv('SIIGO_PARTNER_ID')
@@ -323,130 +516,269 @@ async def get_siigo_token(client: httpx.AsyncClient) -> str:
         "access_key": os.getenv('SIIGO_API_PASSWORD')
          
     }
-    logging.debug(f"Headers: {headers}")
-    logging.debug(f"Auth data: {auth_data}")
+    logger.debug("Headers: %s", headers)
+    logger.debug("Auth data: %s", auth_data)  #access_key se oculta al escribir el log
 
     return await execute_with_retries(
-       lambda: client.post(SIIGO_AUTH_URL, json=auth_data, headers=headers),
+       lambda: send_siigo_request(client, "POST", SIIGO_AUTH_URL, headers, json=auth_data),
         error_message="No se pudo autenticar con Siigo API"
     )
 
-async def execute_with_retries(request_func, retries: int = MAX_RETRIES, error_message: str = ""):
-    #Ejecuta una función de solicitud con reintentos en caso de error.
-    for attempt in range(retries):
-        try:
-            response = await request_func()
-            logging.debug(f"Response status: {response.status_code}")
-            logging.debug(f"Response content: {response.text}")
-            response.raise_for_status()
-            return response.json().get("access_token")
-        except httpx.HTTPError as e:
-            logging.error(f"Error en intento {attempt + 1}: {str(e)}")
-            if attempt == retries - 1:
-                raise HTTPException(status_code=401, detail=f"No se pudo autenticar con Siigo API, {error_message} : {str(e)}")
-            await asyncio.sleep(RETRY_DELAY)
-
-#Funcion para procesar los datos de la hoja de calculo de Google Sheets
-async def process_sheet_data():
-    async with httpx.AsyncClient() as client:
-        rows = await read_sheet_data()     # Leer los datos de la hoja
-        token = await get_siigo_token(client) #obtencion del token siigo
-
-        for row in rows:
-            try:
-                # Verificar que la fila tenga los campos necesarios
-                if len(row) < 5:
-                    logging.warning(f"Fila incompleta: {row}")
-                    continue
+async def execute_with_retries(request_func, policy: RetryPolicy = None, error_message: str = ""):
+    #Ejecuta una función de solicitud con la politica de reintentos (por defecto la de Siigo) y devuelve el JSON de la respuesta
+    policy = policy or siigo_retry
+    try:
+        response = await policy.run(request_func)
+        logger.debug("Response status: %s", response.status_code)
+        logger.debug("Response content: %s", response.text)
+        response.raise_for_status()
+        return response.json()
+    except httpx.HTTPError as e:
+        logger.error("%s: %s", error_message, e)
+        raise HTTPException(status_code=401, detail=f"{error_message} : {str(e)}")
+
+#cliente HTTP compartido, se crea en lifespan y se cierra al apagar la aplicacion
+http_client = None
+
+def get_http_client() -> httpx.AsyncClient:
+    global http_client
+    if http_client is None or http_client.is_closed:
+        #fuera de lifespan (por ejemplo en un script) se crea el cliente en el primer uso
+        http_client = create_http_client(
+            max_connections=HTTP_MAX_CONNECTIONS,
+            max_keepalive_connections=HTTP_MAX_KEEPALIVE_CONNECTIONS,
+            keepalive_expiry=HTTP_KEEPALIVE_EXPIRY,
+            timeout=HTTP_TIMEOUT,
+            connect_timeout=HTTP_CONNECT_TIMEOUT,
+            http2=HTTP2_ENABLED,
+        )
+    return http_client
+
+async def close_http_client():
+    global http_client
+    if http_client is not None:
+        await http_client.aclose()
+        http_client = None
+
+#token de Siigo compartido por todo el proceso (webhooks y sincronizacion de la hoja)
+siigo_tokens = SiigoTokenManager(fetch_siigo_token, refresh_margin=SIIGO_TOKEN_REFRESH_MARGIN)
+#limita las solicitudes simultaneas hacia Siigo sin importar cuantos workers o webhooks esten activos
+siigo_semaphore = asyncio.Semaphore(SIIGO_MAX_CONCURRENT_REQUESTS)
+#limita las solicitudes por minuto hacia Siigo y se adapta a las respuestas 429
+siigo_rate_limiter = SiigoRateLimiter(SIIGO_REQUESTS_PER_MINUTE, burst=SIIGO_RATE_BURST)
+siigo_rate_limit_headroom.set_function(siigo_rate_limiter.headroom)
+siigo_rate_limit_rate.set_function(lambda: siigo_rate_limiter.rate * 60)
+siigo_throttled_total.set_function(lambda: siigo_rate_limiter.throttled_total)
+
+#un circuit breaker por endpoint de Siigo
+siigo_breakers = {
+    name: CircuitBreaker(
+        f"siigo_{name}",
+        failure_threshold=SIIGO_BREAKER_FAILURE_THRESHOLD,
+        recovery_timeout=SIIGO_BREAKER_RECOVERY_TIMEOUT,
+    )
+    for name in ("auth", "customers_get", "customers_post")
+}
+BREAKER_STATE_VALUES = {CircuitBreaker.CLOSED: 0, CircuitBreaker.HALF_OPEN: 1, CircuitBreaker.OPEN: 2}
+siigo_breaker_state.set_function(lambda: {name: BREAKER_STATE_VALUES[breaker.state] for name, breaker in siigo_breakers.items()})
+siigo_breaker_opened_total.set_function(lambda: {name: breaker.opened_total for name, breaker in siigo_breakers.items()})
+siigo_breaker_rejected_total.set_function(lambda: {name: breaker.rejected_total for name, breaker in siigo_breakers.items()})
+
+#nombre del endpoint de Siigo, usado para elegir el circuit breaker y como etiqueta de las metricas
+def siigo_endpoint_for(method: str, url: str) -> str:
+    if url == SIIGO_AUTH_URL:
+        return "auth"
+    return "customers_post" if method.upper() == "POST" else "customers_get"
+
+#politicas de reintento (espera exponencial con jitter) que comparten un solo presupuesto de reintentos
+retry_budget = RetryBudget(ratio=RETRY_BUDGET_RATIO, min_per_second=RETRY_BUDGET_MIN_PER_SECOND)
+
+def is_retryable_google_error(exc: Exception) -> bool:
+    from googleapiclient.errors import HttpError
+    import httplib2
+    if isinstance(exc, HttpError):
+        return exc.resp.status in RETRYABLE_STATUS
+    return isinstance(exc, (TimeoutError, ConnectionError, httplib2.HttpLib2Error))
+
+def is_retryable_smtp_error(exc: Exception) -> bool:
+    if isinstance(exc, (smtplib.SMTPServerDisconnected, smtplib.SMTPConnectError, ConnectionError, TimeoutError)):
+        return True
+    #los codigos 4xx de SMTP son errores temporales (buzon ocupado, limite de envio, etc.)
+    return isinstance(exc, smtplib.SMTPResponseException) and 400 <= exc.smtp_code < 500
+
+siigo_retry = RetryPolicy(
+    "Siigo", max_attempts=MAX_RETRIES, base_delay=RETRY_DELAY, max_delay=RETRY_MAX_DELAY,
+    is_retryable_exception=lambda exc: isinstance(exc, httpx.TransportError), budget=retry_budget,
+)
+sheets_retry = RetryPolicy(
+    "Google Sheets", max_attempts=MAX_RETRIES, base_delay=RETRY_DELAY, max_delay=RETRY_MAX_DELAY,
+    is_retryable_exception=is_retryable_google_error, budget=retry_budget,
+)
+smtp_retry = RetryPolicy(
+    "SMTP", max_attempts=MAX_RETRIES, base_delay=RETRY_DELAY, max_delay=RETRY_MAX_DELAY,
+    is_retryable_exception=is_retryable_smtp_error, budget=retry_budget,
+)
+#identificaciones que ya existen en Siigo, evita repetir la consulta de existencia
+customer_index = CustomerIndex(LOCAL_DB_PATH, ttl=CUSTOMER_INDEX_TTL)
+#huellas de las filas de la hoja ya sincronizadas (modo incremental)
+row_fingerprints = RowFingerprintStore(LOCAL_DB_PATH)
 
-                # Creacion de objeto UserRegistration con los datos de la fila
-                user = UserRegistration(
-                    first_name=row[0],
-                    last_name=row[1],
-                    email=row[2],
-                    phone=row[3],
-                    identification=row[4],
-                    address=row[5] if len(row) > 5 else "",
-                    city=row[6] if len(row) > 6 else ""
-                )
-
-                 #validacion de existencia del cliente en Siigo
-                if not await check_customer_exists(user.identification, token, client):
-                        #si no existe, se crea el cliente en Siigo
-                        siigo_response  = await register_user_in_siigo(user, client)
-
-                        if siigo_response ['status'] == 'new':
-                            # Enviar WhatsApp  por el momento desaactivado
-                            #await send_whatsapp(user.phone, f"Hola {user.first_name}, bienvenido a TIMBALE. Tu cuenta ha sido creada exitosamente")
-                            pass
-                else:
-                    logging.info(f"El Usuario {user.identification} ya existe en Siigo.")
-            except Exception as e:
-                    logging.error(f"Error procesando la fila  {row}: {str(e)}")
+#funcion para obtener el token de acceso de Siigo, se reutiliza el token en cache hasta poco antes de que expire
+async def get_siigo_token(client: httpx.AsyncClient) -> str:
+    return await siigo_tokens.get_token(client)
+
+#Envia una solicitud a Siigo respetando el circuit breaker del endpoint, el limitador de tasa y el limite de concurrencia.
+#Ante un 429 el limitador reduce la tasa y pausa segun Retry-After; el reintento lo decide la politica siigo_retry.
+#Si el circuito esta abierto se lanza CircuitOpenError sin llegar a Siigo
+#El span incluye la espera en el limitador de tasa y el semaforo (atributo siigo.queue_wait_ms)
+async def send_siigo_request(client: httpx.AsyncClient, method: str, url: str, headers: dict, **kwargs) -> httpx.Response:
+    endpoint = siigo_endpoint_for(method, url)
+    breaker = siigo_breakers[endpoint]
+    breaker.before_call()
+    try:
+        with start_span(f"siigo.{endpoint}", **{"http.method": method.upper(), "http.url": url}) as span:
+            queued_at = time.perf_counter()
+            await siigo_rate_limiter.acquire()
+            async with siigo_semaphore:
+                span.set_attribute("siigo.queue_wait_ms", round((time.perf_counter() - queued_at) * 1000, 1))
+                with siigo_requests_in_flight.track_in_progress(), observe_duration(
+                    siigo_request_seconds, endpoint=endpoint, method=method.upper(), status="error"
+                ) as labels:
+                    response = await client.request(method, url, headers=headers, **kwargs)
+                    labels["status"] = str(response.status_code)
+            span.set_attribute("http.status_code", response.status_code)
+    except httpx.TransportError:
+        breaker.record_failure()
+        raise
+    except BaseException:
+        breaker.release()
+        raise
+
+    if response.status_code >= 500:
+        breaker.record_failure()
+    else:
+        breaker.record_success()
+    if response.status_code == 429:
+        siigo_rate_limiter.on_throttled(parse_retry_after(response.headers.get("Retry-After")))
+    else:
+        siigo_rate_limiter.on_success()
+    return response
+
+#Ejecuta una solicitud a la API de Siigo con el token vigente en cache (siigo_tokens); se lee en cada
+#solicitud, asi una renovacion hecha por otra llamada se usa de inmediato. Si Siigo responde 401 (token
+#vencido o revocado) se renueva el token una sola vez y se repite la solicitud de forma transparente
+async def siigo_request(client: httpx.AsyncClient, method: str, url: str, extra_headers: dict = None, **kwargs) -> httpx.Response:
+    token = await siigo_tokens.get_token(client)
+    headers = create_headers(token)
+    if extra_headers:
+        headers.update(extra_headers)
+    response = await siigo_retry.run(lambda: send_siigo_request(client, method, url, headers, **kwargs))
+
+    if response.status_code == 401:
+        logger.warning("Siigo rechazo el token de acceso, renovando y repitiendo la solicitud")
+        token = await siigo_tokens.get_token(client, stale_token=token)
+        headers = create_headers(token)
+        if extra_headers:
+            headers.update(extra_headers)
+        response = await siigo_retry.run(lambda: send_siigo_request(client, method, url, headers, **kwargs))
+    return response
+
+#clave de idempotencia determinista: el mismo cliente genera siempre la misma clave, de modo que
+#dos envios del mismo formulario (o un reintento tras una caida) no crean el cliente dos veces en Siigo
+IDEMPOTENCY_NAMESPACE = uuid.uuid5(uuid.NAMESPACE_URL, "timbale/siigo/customers")
+
+def idempotency_key_for(customer_data: dict) -> str:
+    canonical = json.dumps(customer_data, sort_keys=True, ensure_ascii=False, separators=(",", ":"))
+    return str(uuid.uuid5(IDEMPOTENCY_NAMESPACE, canonical))
 
 # Función para crear cliente en Siigo
-async def create_siigo_customer(customer_data: dict, token: str, client: httpx.AsyncClient):
+async def create_siigo_customer(customer_data: dict, client: httpx.AsyncClient):
     
-    headers = create_headers(token)
-    headers["idempotency-key"] = str(uuid.uuid4())  # Agregar clave de idempotencia
+    # Agregar clave de idempotencia, la misma en todos los reintentos para que Siigo no duplique el cliente
+    headers = {"idempotency-key": idempotency_key_for(customer_data)}
 
-    for attempt in range(MAX_RETRIES):
-        try:
-            response = await client.post(f"{SIIGO_API_URL}/customers", json=customer_data, headers=headers)
-            response.raise_for_status()
-            return response.json()
-        except httpx.HTTPStatusError as e:
-            logging.error(f"Error al crear el cliente en Siigo: {e.response.text}")
-            raise HTTPException(status_code=e.response.status_code, detail="Error al crear el cliente en Siigo.")
-    
-        except httpx.HTTPError as e:
-            if e.response.status_code == 429:  # Límite de solicitudes excedido
-                retry_after = int(e.response.headers.get("Retry-After", RETRY_DELAY))
-                await asyncio.sleep(retry_after)
-            elif e.response.status_code in [400, 401, 403, 404, 500]:
-                error_data = e.response.json()
-                raise HTTPException(status_code=e.response.status_code, detail=f"Error de Siigo API: {error_data.get('message', str(e))}")
-            else:
-                if attempt == MAX_RETRIES - 1:
-                    raise HTTPException(status_code=500, detail=f"Error al crear el cliente en Siigo después de {MAX_RETRIES} intentos")
-                await asyncio.sleep(RETRY_DELAY)
-    raise HTTPException(status_code=500, detail="Error al crear el cliente en Siigo después de {MAX_RETRIES} intentos")
+    # los 429, 5xx y errores de red se reintentan segun la politica siigo_retry
+    try:
+        response = await siigo_request(client, "POST", f"{SIIGO_API_URL}/customers", extra_headers=headers, json=customer_data)
+        response.raise_for_status()
+    except httpx.HTTPStatusError as e:
+        logger.error("Error al crear el cliente en Siigo: %s", e.response.text)
+        raise HTTPException(status_code=e.response.status_code, detail="Error al crear el cliente en Siigo.")
+    except httpx.HTTPError as e:
+        logger.error("Error de conexión con Siigo al crear el cliente: %s", e)
+        raise HTTPException(status_code=500, detail=f"Error al crear el cliente en Siigo después de {MAX_RETRIES} intentos")
+
+    siigo_response = response.json()
+    await asyncio.to_thread(customer_index.add, customer_data.get('identification'), siigo_response.get('id'))
+    return siigo_response
 
             
 #Funcion para verificar si el cliente ya existe en Siigo
-async def check_customer_exists(identification: str, token: str, client: httpx.AsyncClient):
-    headers = create_headers(token)
+#si la identificacion esta en el indice local (dentro del TTL) no se consulta a Siigo
+#el indice se consulta fuera del event loop: SQLite puede esperar el bloqueo de otro worker
+async def check_customer_exists(identification: str, client: httpx.AsyncClient):
+    if await asyncio.to_thread(customer_index.is_known, identification):
+        logger.debug("Cliente %s encontrado en el indice local", identification)
+        return True
+
     params = {"identification": identification}
     try:
-        response = await client.get(f"{SIIGO_API_URL}/customers", headers=headers, params=params)
+        response = await siigo_request(client, "GET", f"{SIIGO_API_URL}/customers", params=params)
         response.raise_for_status()
         customers = response.json().get('results', [])
+        if customers:
+            await asyncio.to_thread(customer_index.add, identification, customers[0].get('id'))
         return len(customers) > 0
     except httpx.HTTPError as e:
         raise HTTPException(status_code=500, detail=f"Error al verificar el cliente en Siigo: {str(e)}")
 
+#Descarga paginada del listado de clientes de Siigo para poblar el indice local
+async def load_customer_index(client: httpx.AsyncClient = None) -> int:
+    client = client or get_http_client()
+    page = 1
+    loaded = 0
+    while True:
+        params = {"page": page, "page_size": CUSTOMER_INDEX_PAGE_SIZE}
+        response = await siigo_request(client, "GET", f"{SIIGO_API_URL}/customers", params=params)
+        response.raise_for_status()
+        data = response.json()
+        customers = data.get('results', [])
+        await asyncio.to_thread(customer_index.add_many, [(customer.get('identification'), customer.get('id')) for customer in customers])
+        loaded += len(customers)
 
-#funcion para procesar el registro de un usuario teniendo en cuenta la existencia de un cliente en Siigo y envio de correo de bienvenida. esta funcion se encarga de orquestar el proceso de registro y envio de correo de bienvenida
-async def process_user_registration(user: UserRegistration, client: httpx.AsyncClient):
-    try:
-        # Registrar al usuario en Siigo
-        result = await register_user_in_siigo(user, client)
+        total_results = data.get('pagination', {}).get('total_results', 0)
+        if not customers or loaded >= total_results:
+            break
+        page += 1
 
-        if result["status"] == "new":
-            siigo_customer_id = result["siigo_customer_id"]
+    logger.info("Indice local de clientes actualizado: %s clientes descargados de Siigo", loaded)
+    return loaded
 
-            # Enviar correo de bienvenida
-            email_sent = await send_welcome_email(user, siigo_customer_id)
-            if email_sent:
-                logging.info("Usuario registrado y correo enviado exitosamente.")
-            else:
-                logging.warning("Usuario registrado, pero no se pudo enviar el correo.")
-        else:
-            logging.warning(result["message"])
 
-    except Exception as e:
-        logging.error(f"Error en el proceso de registro del usuario: {str(e)}")
+#estado de register_user_in_siigo -> etiqueta de timbale_registrations_total; "error" (Siigo respondio sin id) cuenta como fallido
+#se cuenta una vez por registro en Siigo (no por cada solicitud coalescida) en count_registration_in_siigo
+REGISTRATION_METRIC_STATUS = {"new": "created", "existing": "existing", "error": "failed"}
+
+#funcion para procesar el registro de un usuario teniendo en cuenta la existencia de un cliente en Siigo y envio de correo de bienvenida. esta funcion se encarga de orquestar el proceso de registro y envio de correo de bienvenida
+#el correo no se envia aqui: register_new_user_in_siigo lo deja en la outbox y lo envian los workers, asi la solicitud no espera al SMTP
+async def process_user_registration(user: UserRegistration, client: httpx.AsyncClient) -> dict:
+    # Registrar al usuario en Siigo
+    result = await register_user_in_siigo(user, client)
+    if result["status"] != "new":
+        logger.warning(result["message"])
+    return result
+
+
+#pool de conexiones SMTP compartido por todos los envios de correo
+smtp_pool = SMTPConnectionPool(
+    SMTP_SERVER, SMTP_PORT, SMTP_USERNAME, SMTP_PASSWORD,
+    size=SMTP_POOL_SIZE, idle_timeout=SMTP_IDLE_TIMEOUT, starttls=SMTP_STARTTLS,
+)
 
+async def timed_smtp_send(msg):
+    with start_span("smtp.send"), observe_duration(smtp_send_seconds, status="error") as labels:
+        await smtp_pool.send(msg)
+        labels["status"] = "ok"
 
 #Funcion para enviar correos electronicos
 async def send_email(to_email: str, subject: str, body:str) -> bool:
@@ -457,38 +789,69 @@ async def send_email(to_email: str, subject: str, body:str) -> bool:
     msg.attach(MIMEText(body, 'plain'))
 
     try:
-        async with asyncio.Lock: #garantizar la seguridad de subprocesos para operaciones SMTP
-             with smtplib.SMTP(SMTP_SERVER, SMTP_PORT) as server:
-                 server.starttls()
-                 server.login(SMTP_USERNAME, SMTP_PASSWORD)
-                 server.send_message(msg)
-                 logging.info(f"Correo enviado exitosamente a {to_email}")
-                 return True             
+        #el pool reutiliza conexiones autenticadas y envia en sus propios hilos, sin bloquear el event loop
+        await smtp_retry.run(lambda: timed_smtp_send(msg))
+        logger.info("Correo enviado exitosamente a %s", to_email)
+        return True
     except smtplib.SMTPAuthenticationError:
-        logging.error("Error de autenticación SMTP. Verifica tus credenciales.")
+        logger.error("Error de autenticación SMTP. Verifica tus credenciales.")
     except smtplib.SMTPException as e:
-        logging.error(f"Error al enviar el correo: {str(e)}")
+        logger.error("Error al enviar el correo: %s", e)
     except Exception as e:
-        logging.error(f"Error inesperado: {str(e)}")
+        logger.error("Error inesperado: %s", e)
     return False
 
 #maneja el flujo completo de registro de un usuario, incluyendo la verificación de existencia, creación en Siigo, adición a la hoja de cálculo y envío de correo electrónico.
 #funcion para procesar el registro de un usuario
 
+#registros en curso por identificacion: si el formulario se envia dos veces a la vez, la segunda
+#solicitud espera y comparte el resultado de la primera en lugar de repetir la consulta y la creacion
+registration_flights = SingleFlight()
+registrations_in_flight.set_function(registration_flights.in_flight)
+
 async def register_user_in_siigo(user: UserRegistration, client: httpx.AsyncClient) -> dict:
-#obtencion del token siigo
-    token = await get_siigo_token(client)
+    return await registration_flights.do(user.identification, lambda: count_registration_in_siigo(user, client))
+
+#cuerpo del registro compartido por las solicitudes coalescidas: el resultado se cuenta una sola vez.
+#Un rechazo del circuit breaker no se cuenta; el registro se difiere y se cuenta cuando se reintenta
+async def count_registration_in_siigo(user: UserRegistration, client: httpx.AsyncClient) -> dict:
+    try:
+        result = await register_new_user_in_siigo(user, client)
+    except CircuitOpenError:
+        raise
+    except Exception:
+        registrations_total.inc(status="failed")
+        raise
+    registrations_total.inc(status=REGISTRATION_METRIC_STATUS.get(result["status"], "failed"))
+    return result
+
+#cada etapa queda en su propio span para poder atribuir la latencia del registro
+#el token de Siigo lo obtiene siigo_request en cada llamada (en cache)
+async def register_new_user_in_siigo(user: UserRegistration, client: httpx.AsyncClient) -> dict:
     # Verificar si el usuario ya está registrado
-    if await check_customer_exists(user.identification, token, client):
+    with start_span("check_customer_exists") as span:
+        exists = await check_customer_exists(user.identification, client)
+        span.set_attribute("customer.exists", exists)
+    if exists:
         return {"message": "El usuario ya está registrado", "status": "existing"}
     
     #creacion de datos del cliente para enviar a Siigo
-    customer_data = build_customer_data(user)
+    with start_span("build_customer_data"):
+        customer_data = build_customer_data(user)
 
     # Registrar cliente en Siigo
-    siigo_response = await create_siigo_customer(customer_data, token, client)
-
-    return parse_siigo_response(siigo_response)
+    with start_span("create_siigo_customer"):
+        siigo_response = await create_siigo_customer(customer_data, client)
+
+    with start_span("parse_siigo_response"):
+        result = parse_siigo_response(siigo_response)
+
+    #el correo de bienvenida se encola aqui, una sola vez por cliente creado, aunque varias solicitudes
+    #coalescidas compartan este registro
+    if result["status"] == "new":
+        await enqueue_welcome_email(user, result["siigo_customer_id"])
+        logger.info("Usuario registrado, correo de bienvenida en cola.")
+    return result
     
 def build_customer_data(user: UserRegistration) -> dict:
 #Preparacion de los datos para la creación del cliente en Siigo
@@ -510,73 +873,548 @@ def parse_siigo_response(siigo_response: dict) -> dict:
         if 'id' in siigo_response:  
             return {
                 "message": "Usuario registrado exitosamente en Siigo.",
-                "siigo_custumer_id": siigo_response['id'],
+                "siigo_customer_id": siigo_response['id'],
                 "status": "new",
             }
         else:
             return{"message": "Error al registrar usuario en Siigo.", "status": "error"}
 
-#funcion para enviar correo de bienvenida
-async def send_welcome_email(user: UserRegistration, siigo_customer_id: str) -> bool:
+#funcion para armar el asunto y el cuerpo del correo de bienvenida
+def build_welcome_email(first_name: str, siigo_customer_id: str) -> tuple:
     email_subject = (
         "Bienvenido a TIMBALE\nAquí inicia tu viaje donde tu conciencia "
         "toma sentido humano y valor Personal"
     )
     email_body = (
-        f"Hola {user.first_name},\n\n"
+        f"Hola {first_name},\n\n"
         "Tu cuenta ha sido creada exitosamente.\n"
         f"Tu Id de Cliente es: {siigo_customer_id}."
     )
-    return await send_email(user.email, email_subject, email_body)
+    return email_subject, email_body
+
+#cola persistente de notificaciones pendientes
+outbox = Outbox(LOCAL_DB_PATH)
+outbox_wakeup = asyncio.Event()  #despierta a los workers cuando se encola un trabajo
+outbox_queue_depth.set_function(outbox.pending_count)
+OUTBOX_WELCOME_EMAIL = "welcome_email"
+
+#las operaciones de la outbox se ejecutan fuera del event loop: SQLite puede esperar el bloqueo de otro worker
+async def enqueue_welcome_email(user: UserRegistration, siigo_customer_id: str) -> str:
+    #la clave evita encolar dos veces el correo de bienvenida del mismo cliente
+    job_id = await asyncio.to_thread(outbox.enqueue, OUTBOX_WELCOME_EMAIL, {
+        "email": user.email,
+        "first_name": user.first_name,
+        "siigo_customer_id": siigo_customer_id,
+    }, dedupe_key=str(siigo_customer_id))
+    outbox_wakeup.set()
+    return job_id
+
+#ejecuta un trabajo de la outbox y devuelve su resultado; una excepcion o un envio fallido provocan un reintento
+async def handle_outbox_job(job: dict) -> dict:
+    payload = job["payload"]
+    if job["kind"] == OUTBOX_WELCOME_EMAIL:
+        email_subject, email_body = build_welcome_email(payload["first_name"], payload["siigo_customer_id"])
+        if not await send_email(payload["email"], email_subject, email_body):
+            raise EmailAPIError(f"No se pudo enviar el correo de bienvenida a {payload['email']}")
+        return {"sent_to": payload["email"]}
+    elif job["kind"] == OUTBOX_SIIGO_REGISTRATION:
+        #si Siigo sigue sin responder (CircuitOpenError u otro error) el registro se reintenta mas tarde
+        result = await process_user_registration(UserRegistration(**payload), get_http_client())
+        logger.info("Registro diferido de %s procesado: %s", payload['identification'], result['status'])
+        return result
+    else:
+        raise ValueError(f"Tipo de trabajo desconocido en la outbox: {job['kind']}")
+
+#registro diferido (modo asincrono o Siigo no disponible); lo completan los workers de la outbox.
+#Un segundo envio de la misma identificacion mientras el primero sigue pendiente reutiliza el mismo trabajo
+OUTBOX_SIIGO_REGISTRATION = "siigo_registration"
+
+async def enqueue_registration(user: UserRegistration) -> str:
+    job_id = await asyncio.to_thread(outbox.enqueue, OUTBOX_SIIGO_REGISTRATION, jsonable_encoder(user), dedupe_key=user.identification)
+    outbox_wakeup.set()
+    return job_id
+
+#tiempo de espera antes del siguiente intento: exponencial, con tope OUTBOX_RETRY_MAX_DELAY
+def outbox_retry_delay(attempts: int) -> float:
+    return min(OUTBOX_RETRY_MAX_DELAY, OUTBOX_RETRY_BASE_DELAY * (2 ** attempts))
+
+#Un error de la base local (por ejemplo "database is locked" mientras otro worker escribe) no detiene al
+#worker: se registra y se reintenta en el siguiente ciclo. Si no se pudo marcar un trabajo, su reserva vence
+#(Outbox.lease) y se vuelve a tomar
+async def outbox_worker():
+    while True:
+        try:
+            jobs = await asyncio.to_thread(outbox.claim, 10)
+        except sqlite3.Error as e:
+            logger.error("No se pudieron tomar trabajos de la outbox: %s", e)
+            await asyncio.sleep(OUTBOX_POLL_INTERVAL)
+            continue
+        if not jobs:
+            outbox_wakeup.clear()
+            try:
+                await asyncio.wait_for(outbox_wakeup.wait(), timeout=OUTBOX_POLL_INTERVAL)
+            except asyncio.TimeoutError:
+                pass
+            continue
+
+        for job in jobs:
+            request_id = request_id_var.set(f"outbox-{job['id']}")
+            try:
+                await run_outbox_job(job)
+            finally:
+                request_id_var.reset(request_id)
+
+async def run_outbox_job(job: dict):
+    try:
+        with start_span("outbox_job", **{"job.id": job["id"], "job.kind": job["kind"]}):
+            result = await handle_outbox_job(job)
+    except Exception as e:
+        attempts = job["attempts"] + 1
+        try:
+            if attempts >= OUTBOX_MAX_ATTEMPTS:
+                logger.error("Trabajo %s de la outbox descartado tras %s intentos: %s", job['id'], attempts, e)
+                await asyncio.to_thread(outbox.mark_failed, job["id"], str(e))
+            else:
+                delay = outbox_retry_delay(job["attempts"])
+                logger.warning("Trabajo %s de la outbox fallo (intento %s), reintento en %s s: %s", job['id'], attempts, delay, e)
+                await asyncio.to_thread(outbox.mark_failed, job["id"], str(e), time.time() + delay)
+        except sqlite3.Error as db_error:
+            logger.error("No se pudo registrar el fallo del trabajo %s de la outbox: %s", job['id'], db_error)
+        return
+
+    try:
+        await asyncio.to_thread(outbox.mark_done, job["id"], result)
+    except sqlite3.Error as e:
+        logger.error("No se pudo marcar como completado el trabajo %s de la outbox: %s", job['id'], e)
+
+
+#estado de la precarga de cada componente: "pending", "ready" o el ultimo error; /ready responde 200
+#solo cuando todos estan listos
+warmup_state = {"google": "pending", "siigo": "pending"}
+
+async def warm_up_google():
+    await run_google_io(get_google_service, 'sheets', 'v4')
+    await run_google_io(get_google_service, 'gmail', 'v1')
+
+async def warm_up_siigo():
+    await get_siigo_token(get_http_client())
+
+#Precarga en segundo plano de credenciales, servicios de Google y token de Siigo, para que la primera
+#solicitud no pague ese costo. Los componentes que fallan se reintentan cada WARMUP_RETRY_INTERVAL segundos
+async def warm_up():
+    steps = {"google": warm_up_google, "siigo": warm_up_siigo}
+    while True:
+        for name, step in steps.items():
+            if warmup_state[name] == "ready":
+                continue
+            try:
+                await step()
+                warmup_state[name] = "ready"
+            except Exception as e:
+                warmup_state[name] = f"error: {str(e)}"
+                logger.error("Fallo la precarga de %s: %s", name, e)
+        if all(state == "ready" for state in warmup_state.values()):
+            logger.info("Precarga de credenciales y servicios completa")
+            return
+        await asyncio.sleep(WARMUP_RETRY_INTERVAL)
+
+#Eleccion de lider entre workers: todos atienden webhooks, pero las tareas programadas (sincronizacion de la
+#hoja, carga del indice de clientes) solo corren en el worker que tiene el lease
+sync_leader = LeaderLease(
+    LOCAL_DB_PATH, "scheduled-jobs", holder=f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:8]}", ttl=LEADER_LEASE_TTL,
+)
+
+def refresh_leadership() -> bool:
+    was_leader = sync_leader.is_leader
+    try:
+        is_leader = sync_leader.try_acquire()
+    except Exception as e:
+        logger.error("No se pudo renovar el lease de lider: %s", e)
+        return sync_leader.is_leader
+    if is_leader != was_leader:
+        logger.info("Worker %s %s el lider de las tareas programadas", sync_leader.holder, "es ahora" if is_leader else "dejo de ser")
+    return is_leader
+
+async def leader_loop():
+    while True:
+        await asyncio.sleep(LEADER_LEASE_TTL / 3)
+        await asyncio.to_thread(refresh_leadership)  #SQLite puede esperar el bloqueo de otro worker, fuera del event loop
+
+#envuelve una tarea programada para que solo se ejecute en el lider
+def leader_only(func):
+    @functools.wraps(func)
+    async def wrapper(*args, **kwargs):
+        if LEADER_ELECTION and not sync_leader.is_leader:
+            logger.debug("Tarea %s omitida: este worker no es el lider", func.__name__)
+            return None
+        return await func(*args, **kwargs)
+    return wrapper
+
+#Sincronizaciones de la hoja: una sola ejecucion activa (tambien entre workers, con el lease sheet-sync-run),
+#los disparos que llegan durante una ejecucion se agrupan en una sola ejecucion de seguimiento y la marca de
+#la ultima sincronizacion exitosa se guarda en la base local. El estado y el progreso de cada ejecucion tambien
+#se guardan en la base local, asi cualquier worker puede responder /process-sheet/{run_id}
+sync_state = SyncStateStore(LOCAL_DB_PATH)
+sync_runs = SyncRunStore(LOCAL_DB_PATH)
+sheet_sync_lock = LeaderLease(LOCAL_DB_PATH, "sheet-sync-run", holder=sync_leader.holder, ttl=LEADER_LEASE_TTL)
+
+async def run_sheet_sync(run) -> dict:
+    run.progress = SyncReport()
+    options = run.options
+    report = await process_sheet_data(
+        incremental=SYNC_INCREMENTAL and not options.get("full", False),
+        start_row=options.get("start_row") or 1,
+        end_row=options.get("end_row"),
+        identifications=options.get("identifications"),
+        report=run.progress,
+    )
+    return report.summary()
 
+sync_coordinator = SyncCoordinator(
+    run_sheet_sync, sync_state, run_lock=sheet_sync_lock, run_store=sync_runs, progress_interval=SYNC_PROGRESS_INTERVAL,
+)
+sheet_sync_lag = metrics.gauge("timbale_sheet_sync_lag_seconds", "Segundos desde la ultima sincronizacion exitosa de la hoja")
+sheet_sync_lag.set_function(sync_coordinator.lag)
+sheet_sync_duration = metrics.gauge("timbale_sheet_sync_last_duration_seconds", "Duracion de la ultima sincronizacion exitosa")
+sheet_sync_duration.set_function(sync_coordinator.last_duration)
+
+@leader_only
+async def scheduled_sheet_sync():
+    await sync_coordinator.trigger("schedule")
+
+def sheet_sync_trigger():
+    if SHEET_SYNC_CRON:
+        return CronTrigger.from_crontab(SHEET_SYNC_CRON)
+    return IntervalTrigger(minutes=SHEET_SYNC_INTERVAL_MINUTES)
+
+#sincronizacion de recuperacion si el servicio estuvo detenido durante una o mas ejecuciones programadas
+async def catch_up_sheet_sync():
+    await sync_coordinator.refresh_state()
+    lag = sync_coordinator.lag()
+    if lag is not None and lag > SHEET_SYNC_INTERVAL_MINUTES * 60:
+        logger.info("Ultima sincronizacion exitosa hace %.0f min, se inicia una sincronizacion de recuperacion", lag / 60)
+        await sync_coordinator.trigger("catch_up")
 
 #funcion para ejecutar el proceso de la hoja de calculo de Google Sheets cada 30 minutos
 @asynccontextmanager
 async def lifespan(app: FastAPI):
     # Código de inicialización
+    validate_env_vars()
+    setup_tracing("timbale", TRACING_EXPORTER, TRACING_FILE)
+    get_http_client()  #pool de conexiones compartido por webhooks y sincronizaciones
+    warmup_task = asyncio.create_task(warm_up())  #no retrasa el arranque: el servidor acepta solicitudes de inmediato
+    outbox_tasks = [asyncio.create_task(outbox_worker()) for _ in range(OUTBOX_WORKERS)]
     scheduler = AsyncIOScheduler()
-    scheduler.add_job(process_sheet_data, 'interval', minutes=30)
+    leader_task = None
+    if LEADER_ELECTION:
+        refresh_leadership()  #antes de iniciar el scheduler, para que la carga inicial la haga el lider
+        leader_task = asyncio.create_task(leader_loop())
+    #max_instances y coalesce: una ejecucion programada atrasada o repetida se dispara una sola vez
+    scheduler.add_job(
+        scheduled_sheet_sync, sheet_sync_trigger(),
+        max_instances=1, coalesce=True, misfire_grace_time=SHEET_SYNC_MISFIRE_GRACE,
+    )
+    if SHEET_SYNC_CATCH_UP and (sync_leader.is_leader or not LEADER_ELECTION):
+        await catch_up_sheet_sync()
+    if CUSTOMER_INDEX_BULK_LOAD:
+        #primera carga al iniciar y luego actualizacion periodica del indice local
+        scheduler.add_job(leader_only(load_customer_index), 'interval', hours=CUSTOMER_INDEX_REFRESH_HOURS, next_run_time=datetime.now())
     scheduler.start()
     
     yield  # Este yield es donde la aplicación se ejecuta
     
     # Código de limpieza (si es necesario)
+    warmup_task.cancel()
     scheduler.shutdown()
+    await sync_coordinator.stop()
+    if leader_task is not None:
+        leader_task.cancel()
+        sync_leader.release()  #otro worker puede tomar el liderazgo sin esperar a que venza el lease
+    for task in outbox_tasks:
+        task.cancel()
+    await asyncio.gather(*outbox_tasks, return_exceptions=True)
+    await close_http_client()
+    google_io_executor.shutdown(wait=False)
+    await smtp_pool.close()
+    shutdown_tracing()
 
 app = FastAPI(lifespan=lifespan)
+
+#mide la duracion de cada solicitud recibida; la etiqueta endpoint usa la ruta declarada
+#(por ejemplo /jobs/{job_id}) para no crear una serie por cada valor de la URL
+@app.middleware("http")
+async def record_request_metrics(request: FastAPIRequest, call_next):
+    start = time.perf_counter()
+    status = 500
+    try:
+        with http_requests_in_flight.track_in_progress():
+            response = await call_next(request)
+        status = response.status_code
+        return response
+    finally:
+        route = request.scope.get("route")
+        endpoint = route.path if route is not None else "unmatched"
+        http_request_seconds.observe(time.perf_counter() - start, endpoint=endpoint, method=request.method, status=str(status))
+
+#id de solicitud: se toma del encabezado X-Request-ID o se genera uno, se agrega a los logs y a los
+#spans, y se devuelve en la respuesta. El span raiz cubre toda la solicitud
+@app.middleware("http")
+async def assign_request_id(request: FastAPIRequest, call_next):
+    request_id = request.headers.get("x-request-id") or new_request_id()
+    token = request_id_var.set(request_id)
+    try:
+        with start_span(f"{request.method} {request.url.path}", **{"http.method": request.method}) as span:
+            response = await call_next(request)
+            route = request.scope.get("route")
+            if route is not None:
+                span.set_attribute("http.route", route.path)
+            span.set_attribute("http.status_code", response.status_code)
+        response.headers["X-Request-ID"] = request_id
+        return response
+    finally:
+        request_id_var.reset(token)
         
 @app.post("/register-from-timbale")
 async def register_from_timbale(user_data: UserRegistration, background_tasks: BackgroundTasks):
-    logging.debug(f"Recibida solicitud para registrar usuario: {user_data}")
+    logger.debug("Recibida solicitud para registrar usuario: %s", user_data)
+    if REGISTRATION_ASYNC:
+        #los datos ya fueron validados por el modelo UserRegistration; Siigo se procesa en segundo plano
+        job_id = await enqueue_registration(user_data)
+        return JSONResponse(
+            status_code=202,
+            content={"message": "Registro recibido, se procesará en segundo plano.", "status": "accepted", "job_id": job_id},
+        )
     try:
-        async with httpx.AsyncClient() as client:
-        # Procesar los datos del formulario
-          result = await register_user_in_siigo(user_data, client)
-          logging.debug("Iniciando proceso de registro en Siigo")
-          #ela linea siguiente es para nviar mensaje de whatsapp
-          #background_tasks.add_task(send_whatsapp_message, user_data.phone, f"Hola {user_data.first_name}, Estamos Felices de que ahora haces Parte de la Famili Timbale, Tu registro fue exitoso.")
+        client = get_http_client()
+        # Procesar los datos del formulario (registro en Siigo y correo de bienvenida en cola)
+        result = await process_user_registration(user_data, client)
+        logger.debug("Iniciando proceso de registro en Siigo")
+        #ela linea siguiente es para nviar mensaje de whatsapp
+        #background_tasks.add_task(send_whatsapp_message, user_data.phone, f"Hola {user_data.first_name}, Estamos Felices de que ahora haces Parte de la Famili Timbale, Tu registro fue exitoso.")
         
         return result
+    except CircuitOpenError as e:
+        #Siigo no esta disponible: se responde de inmediato en lugar de esperar todos los reintentos
+        if SIIGO_DEFER_WHEN_OPEN:
+            job_id = await enqueue_registration(user_data)
+            logger.warning("Siigo no disponible, registro de %s diferido (trabajo %s)", user_data.identification, job_id)
+            return JSONResponse(
+                status_code=202,
+                content={"message": "Siigo no está disponible, el registro se completará más tarde.", "status": "deferred", "job_id": job_id},
+            )
+        raise HTTPException(status_code=503, detail=str(e), headers={"Retry-After": str(int(e.retry_after) + 1)})
     except SiigoAPIError as e:
-        logging.error(f"Error al crear el cliente en Siigo: {str(e)}")
+        logger.error("Error al crear el cliente en Siigo: %s", e)
         raise HTTPException(status_code=500, detail=f"Error al crear el cliente en Siigo: {str(e)}")
     except EmailAPIError as e:
         raise HTTPException(status_code=500, detail=f"Error al enviar el correo electrónico: {str(e)}")
     except Exception as e:
-        logging.error(f"Error al registrar usuario en Siigo: {str(e)}")
+        logger.error("Error al registrar usuario en Siigo: %s", e)
         raise HTTPException(status_code=500, detail=f"Error interno inesperado del servidor: {str(e)}")
 
+#Registro masivo: lee los registros de un arreglo JSON o de un flujo NDJSON (una linea por registro)
+async def iter_json_items(items: list):
+    for item in items:
+        yield item
+
+#el cuerpo se lee completo antes de responder: leer la solicitud mientras se envia la respuesta en
+#streaming compite con la deteccion de desconexion de Starlette
+async def iter_ndjson_items(body: bytes):
+    for line in body.splitlines():
+        if line.strip():
+            yield parse_ndjson_line(line)
+
+def parse_ndjson_line(line: bytes):
+    try:
+        return json.loads(line)
+    except ValueError as e:
+        return e  #la linea se reporta como invalida sin detener el resto del lote
+
+#Procesa los registros de un lote con BATCH_CONCURRENCY tareas concurrentes y entrega cada resultado en cuanto
+#termina. Las identificaciones repetidas dentro del lote se procesan una sola vez. Todas las tareas comparten
+#el token de Siigo en cache y los limites globales de concurrencia y tasa hacia Siigo.
+async def stream_batch_results(items, client: httpx.AsyncClient):
+    results = asyncio.Queue()
+    semaphore = asyncio.Semaphore(BATCH_CONCURRENCY)
+    counts = {}
+    tasks = set()
+
+    async def register_item(index: int, user: UserRegistration):
+        try:
+            result = await process_user_registration(user, client)
+            item = {"index": index, "identification": user.identification, **result}
+        except CircuitOpenError:
+            #si tampoco se puede encolar (por ejemplo SQLite bloqueado) el registro queda como fallido
+            try:
+                job_id = await enqueue_registration(user)
+                item = {"index": index, "identification": user.identification, "status": "deferred", "job_id": job_id}
+            except Exception as e:
+                logger.error("No se pudo diferir el registro masivo de %s: %s", user.identification, e)
+                item = {"index": index, "identification": user.identification, "status": "failed", "message": str(e)}
+        except Exception as e:
+            logger.error("Error en el registro masivo de %s: %s", user.identification, e)
+            item = {"index": index, "identification": user.identification, "status": "failed", "message": str(e)}
+        finally:
+            semaphore.release()
+        await results.put(item)
+
+    async def producer():
+        seen = set()
+        index = -1
+        try:
+            async for raw in items:
+                index += 1
+                try:
+                    if not isinstance(raw, dict):
+                        raise ValueError(f"Registro invalido: {raw}")
+                    user = UserRegistration(**raw)
+                except (ValidationError, ValueError) as e:
+                    await results.put({"index": index, "status": "invalid", "message": str(e)})
+                    continue
+                if user.identification in seen:
+                    await results.put({"index": index, "identification": user.identification, "status": "duplicate"})
+                    continue
+                seen.add(user.identification)
+
+                await semaphore.acquire()  #no se crean mas tareas que las permitidas
+                task = asyncio.create_task(register_item(index, user))
+                tasks.add(task)
+                task.add_done_callback(tasks.discard)
+            await asyncio.gather(*list(tasks))
+        finally:
+            await results.put(None)
+
+    producer_task = asyncio.create_task(producer())
+    try:
+        while True:
+            item = await results.get()
+            if item is None:
+                break
+            counts[item["status"]] = counts.get(item["status"], 0) + 1
+            yield json.dumps(item, ensure_ascii=False) + "\n"
+        await producer_task
+        yield json.dumps({"summary": counts}, ensure_ascii=False) + "\n"
+    finally:
+        #el cliente cerro la conexion antes de terminar el lote
+        if not producer_task.done():
+            producer_task.cancel()
+        for task in list(tasks):
+            task.cancel()
+
+@app.post("/register-batch")
+async def register_batch(request: FastAPIRequest):
+    content_type = request.headers.get("content-type", "")
+    if "ndjson" in content_type:
+        items = iter_ndjson_items(await request.body())
+    else:
+        try:
+            data = await request.json()
+        except ValueError:
+            raise HTTPException(status_code=400, detail="El cuerpo debe ser un arreglo JSON o NDJSON de registros")
+        if not isinstance(data, list):
+            raise HTTPException(status_code=400, detail="Se esperaba un arreglo de registros")
+        items = iter_json_items(data)
+    return StreamingResponse(stream_batch_results(items, get_http_client()), media_type="application/x-ndjson")
+
+#Inicia una sincronizacion de la hoja y devuelve el id de la ejecucion. Si ya hay una sincronizacion en curso
+#la nueva queda en cola (o se agrupa con una en cola con las mismas opciones). Opciones del cuerpo:
+#start_row / end_row (rango de filas), identifications (solo esas filas) y full (ignorar las huellas)
 @app.post("/process-sheet")
-async def trigger_process_sheet():
-    background_tasks= BackgroundTasks()
-    background_tasks.add_task(process_sheet_data)
-    return {"message": "Procesamiento de la hoja iniciado en segundo plano"}
+async def trigger_process_sheet(sync_request: Optional[SheetSyncRequest] = None):
+    sync_request = sync_request or SheetSyncRequest()
+    if sync_request.start_row is not None and sync_request.start_row < 1:
+        raise HTTPException(status_code=400, detail="start_row debe ser mayor o igual a 1")
+    if sync_request.end_row is not None and sync_request.end_row < (sync_request.start_row or 1):
+        raise HTTPException(status_code=400, detail="end_row debe ser mayor o igual a start_row")
+
+    options = {key: value for key, value in sync_request.model_dump().items() if value not in (None, False, [])}
+    if "identifications" in options:
+        options["identifications"] = sorted(set(options["identifications"]))
+    partial = any(key in options for key in ("start_row", "end_row", "identifications"))
+    run = await sync_coordinator.trigger("manual", options, partial=partial)
+    return JSONResponse(
+        status_code=202,
+        content={
+            "message": "Procesamiento de la hoja iniciado en segundo plano",
+            "run_id": run.run_id,
+            "status": run.status,
+            "progress_url": f"/process-sheet/{run.run_id}",
+        },
+    )
+
+#Progreso de una sincronizacion en NDJSON: una linea por intervalo con filas leidas, omitidas, creadas y
+#fallidas y filas por segundo, y una linea final con el resumen. Responde cualquier worker: si la ejecucion
+#es de otro worker se lee la ultima foto guardada en la base local. Si una ejecucion sin terminar (en cola,
+#esperando o en curso) deja de actualizarse por SYNC_RUN_STALE_SECONDS la respuesta termina con "stale": true
+@app.get("/process-sheet/{run_id}")
+async def sheet_sync_progress(run_id: str):
+    snapshot = await sync_coordinator.snapshot(run_id)
+    if snapshot is None:
+        raise HTTPException(status_code=404, detail=f"No existe la sincronizacion {run_id}")
+
+    async def stream_progress():
+        current = snapshot
+        while current["status"] not in (SyncRun.DONE, SyncRun.FAILED):
+            updated_at = current.get("updated_at")
+            if updated_at and time.time() - updated_at > SYNC_RUN_STALE_SECONDS:
+                yield json.dumps({**current, "stale": True}, ensure_ascii=False) + "\n"
+                return
+            yield json.dumps(current, ensure_ascii=False) + "\n"
+            await asyncio.sleep(SYNC_PROGRESS_INTERVAL)
+            current = await sync_coordinator.snapshot(run_id) or current
+        yield json.dumps(current, ensure_ascii=False) + "\n"
+
+    return StreamingResponse(stream_progress(), media_type="application/x-ndjson")
+
+
+#estado de un registro diferido por el id aleatorio entregado en la respuesta 202
+@app.get("/jobs/{job_id}")
+async def get_job_status(job_id: str):
+    job = await asyncio.to_thread(outbox.status, job_id, OUTBOX_SIIGO_REGISTRATION)
+    if job is None:
+        raise HTTPException(status_code=404, detail=f"No existe el trabajo {job_id}")
+    return job
+
+#estado del servicio: circuit breakers de Siigo, limitador de tasa y trabajos pendientes en la outbox
+@app.get("/health")
+async def health():
+    breakers = {name: breaker.stats() for name, breaker in siigo_breakers.items()}
+    degraded = any(stats["state"] != CircuitBreaker.CLOSED for stats in breakers.values())
+    return {
+        "status": "degraded" if degraded else "ok",
+        "siigo_breakers": breakers,
+        "siigo_rate_limit": siigo_rate_limiter.stats(),
+        "outbox_pending": await asyncio.to_thread(outbox.pending_count),
+        "scheduler_leader": {"is_leader": sync_leader.is_leader, "lease": sync_leader.current()} if LEADER_ELECTION else None,
+    }
+
+#metricas de rendimiento en formato de texto de Prometheus
+@app.get("/metrics")
+async def prometheus_metrics():
+    await sync_coordinator.refresh_state()  #los gauges de la sincronizacion leen el estado en memoria
+    return Response(content=metrics.render(), media_type=MetricsRegistry.CONTENT_TYPE)
+
+#estado de la sincronizacion de la hoja: ejecucion activa, ejecuciones en cola, retraso y ultima duracion
+@app.get("/sync/status")
+async def sheet_sync_status():
+    await sync_coordinator.refresh_state()
+    return sync_coordinator.status()
+
+#prueba de disponibilidad (readiness): 503 hasta que la precarga de credenciales y servicios termina
+@app.get("/ready")
+async def readiness():
+    ready = all(state == "ready" for state in warmup_state.values())
+    return JSONResponse(status_code=200 if ready else 503, content={"ready": ready, "components": warmup_state})
+
+#estado del limitador de tasa de Siigo: tasa actual, cupo disponible y numero de respuestas 429
+@app.get("/rate-limit")
+async def siigo_rate_limit_status():
+    return siigo_rate_limiter.stats()
 
 
 @app.exception_handler(Exception)
 async def global_exception_handler(request: Request, exc: Exception):
-    logging.error(f"Error no manejado: {str(exc)}")
-    logging.error(f"Traceback: {traceback.format_exc()}")
+    logger.error("Error no manejado: %s", exc, exc_info=exc)  #el traceback va en el campo "exception"
     return JSONResponse(
         status_code=500,
         content={"message": "Error interno del servidor"}
@@ -0,0 +1,191 @@
+#Metricas de rendimiento en formato de texto de Prometheus (contadores, gauges e histogramas con etiquetas)
+import bisect
+import threading
+import time
+from contextlib import contextmanager
+
+
+#limites de los buckets de latencia en segundos
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+
+
+def _escape(value) -> str:
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _format_labels(labelnames, values, extra: str = "") -> str:
+    parts = [f'{name}="{_escape(value)}"' for name, value in zip(labelnames, values)]
+    if extra:
+        parts.append(extra)
+    return "{" + ",".join(parts) + "}" if parts else ""
+
+
+def _format_value(value: float) -> str:
+    if value == float("inf"):
+        return "+Inf"
+    return repr(float(value)) if not float(value).is_integer() else str(int(value))
+
+
+#Base comun: cada combinacion de valores de etiquetas es una serie distinta.
+#Todas las operaciones usan un lock porque se actualizan desde el event loop y desde los hilos de Google y SMTP
+class _Metric:
+    kind = ""
+
+    def __init__(self, name: str, documentation: str, labelnames=()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._series = {}
+        self._lock = threading.Lock()
+        self._function = None
+
+    def _key(self, labels: dict) -> tuple:
+        if set(labels) != set(self.labelnames):
+            raise ValueError(f"La metrica {self.name} espera las etiquetas {self.labelnames}, se recibio {tuple(labels)}")
+        return tuple(str(labels[name]) for name in self.labelnames)
+
+    def _samples(self):
+        if self._function is not None:
+            return self._function_samples()
+        return self._stored_samples()
+
+    #El valor se calcula al momento de exportar (por ejemplo el numero de trabajos pendientes en la outbox
+    #o un total que ya lleva otro componente), sin tener que mantenerlo al dia.
+    #En una metrica con etiquetas la funcion devuelve un diccionario {valores de las etiquetas: valor};
+    #con una sola etiqueta la clave puede ser el valor directamente en lugar de una tupla
+    def set_function(self, function):
+        self._function = function
+
+    def _function_samples(self):
+        try:
+            value = self._function()
+        except Exception:
+            return []  #la fuente no esta disponible; la serie se omite en esta lectura
+        if value is None:
+            return []
+        if not self.labelnames:
+            return [f"{self.name} {_format_value(value)}"]
+        series = sorted((key if isinstance(key, tuple) else (key,), item) for key, item in value.items())
+        return [f"{self.name}{_format_labels(self.labelnames, key)} {_format_value(item)}" for key, item in series if item is not None]
+
+    def _stored_samples(self):
+        with self._lock:
+            series = sorted(self._series.items())
+        return [f"{self.name}{_format_labels(self.labelnames, key)} {_format_value(value)}" for key, value in series]
+
+    def render(self) -> str:
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.kind}"]
+        lines.extend(self._samples())
+        return "\n".join(lines)
+
+
+class Counter(_Metric):
+    kind = "counter"
+
+    def inc(self, amount: float = 1, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._series[key] = self._series.get(key, 0) + amount
+
+
+#Gauge: valor que sube y baja
+class Gauge(_Metric):
+    kind = "gauge"
+
+    def set(self, value: float, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._series[key] = value
+
+    def inc(self, amount: float = 1, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._series[key] = self._series.get(key, 0) + amount
+
+    def dec(self, amount: float = 1, **labels):
+        self.inc(-amount, **labels)
+
+    #suma 1 mientras dura el bloque, para contar operaciones en curso
+    @contextmanager
+    def track_in_progress(self, **labels):
+        self.inc(**labels)
+        try:
+            yield
+        finally:
+            self.dec(**labels)
+
+
+class Histogram(_Metric):
+    kind = "histogram"
+
+    def __init__(self, name: str, documentation: str, labelnames=(), buckets=DEFAULT_BUCKETS):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(sorted(buckets))
+
+    def observe(self, value: float, **labels):
+        key = self._key(labels)
+        with self._lock:
+            series = self._series.get(key)
+            if series is None:
+                #conteo por bucket (no acumulado), suma y total de observaciones
+                series = self._series[key] = [[0] * len(self.buckets), 0.0, 0]
+            index = bisect.bisect_left(self.buckets, value)
+            if index < len(self.buckets):
+                series[0][index] += 1
+            series[1] += value
+            series[2] += 1
+
+    def _samples(self):
+        with self._lock:
+            series = sorted((key, (list(counts), total, count)) for key, (counts, total, count) in self._series.items())
+        lines = []
+        inf = 'le="+Inf"'
+        for key, (counts, total, count) in series:
+            cumulative = 0
+            for bound, bucket_count in zip(self.buckets, counts):
+                cumulative += bucket_count
+                le = f'le="{_format_value(bound)}"'
+                lines.append(f"{self.name}_bucket{_format_labels(self.labelnames, key, le)} {cumulative}")
+            lines.append(f"{self.name}_bucket{_format_labels(self.labelnames, key, inf)} {count}")
+            lines.append(f"{self.name}_sum{_format_labels(self.labelnames, key)} {_format_value(total)}")
+            lines.append(f"{self.name}_count{_format_labels(self.labelnames, key)} {count}")
+        return lines
+
+
+#Registro de todas las metricas del servicio; render() produce el cuerpo de /metrics
+class MetricsRegistry:
+    CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+    def __init__(self):
+        self._metrics = []
+        self._lock = threading.Lock()
+
+    def _register(self, metric):
+        with self._lock:
+            self._metrics.append(metric)
+        return metric
+
+    def counter(self, name: str, documentation: str, labelnames=()) -> Counter:
+        return self._register(Counter(name, documentation, labelnames))
+
+    def gauge(self, name: str, documentation: str, labelnames=()) -> Gauge:
+        return self._register(Gauge(name, documentation, labelnames))
+
+    def histogram(self, name: str, documentation: str, labelnames=(), buckets=DEFAULT_BUCKETS) -> Histogram:
+        return self._register(Histogram(name, documentation, labelnames, buckets))
+
+    def render(self) -> str:
+        with self._lock:
+            metrics = list(self._metrics)
+        return "\n".join(metric.render() for metric in metrics) + "\n"
+
+
+#mide la duracion de un bloque en segundos y la registra en el histograma; las etiquetas pueden
+#completarse dentro del bloque (por ejemplo el estado HTTP, que solo se conoce al final)
+@contextmanager
+def observe_duration(histogram: Histogram, **labels):
+    start = time.perf_counter()
+    try:
+        yield labels
+    finally:
+        histogram.observe(time.perf_counter() - start, **labels)
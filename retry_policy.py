@@ -0,0 +1,112 @@
+#Politica de reintentos comun para Siigo, Google Sheets y SMTP
+import asyncio
+import logging
+import random
+import threading
+import time
+from email.utils import parsedate_to_datetime
+
+logger = logging.getLogger(__name__)
+
+
+#estados HTTP que indican un error transitorio
+RETRYABLE_STATUS = (408, 429, 500, 502, 503, 504)
+
+
+#convierte el encabezado Retry-After (segundos o fecha HTTP) en segundos de espera
+def parse_retry_after(value) -> float:
+    if not value:
+        return None
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+    try:
+        return max(0.0, parsedate_to_datetime(value).timestamp() - time.time())
+    except (TypeError, ValueError):
+        return None
+
+
+#Presupuesto global de reintentos. Cada solicitud original deposita `ratio` y cada reintento
+#consume 1, ademas de un minimo de `min_per_second` reintentos por segundo. Cuando un servicio
+#falla de forma masiva el presupuesto se agota y los reintentos dejan de multiplicar la carga.
+class RetryBudget:
+    def __init__(self, ratio: float = 0.2, min_per_second: float = 1.0, max_balance: float = 20):
+        self.ratio = ratio
+        self.min_per_second = min_per_second
+        self.max_balance = max_balance
+        self.balance = max_balance
+        self.exhausted_total = 0
+        self._updated = time.monotonic()
+        self._lock = threading.Lock()  #la usan tanto el event loop como los hilos de SMTP y Google
+
+    def _refill(self):
+        now = time.monotonic()
+        self.balance = min(self.max_balance, self.balance + (now - self._updated) * self.min_per_second)
+        self._updated = now
+
+    def on_request(self):
+        with self._lock:
+            self._refill()
+            self.balance = min(self.max_balance, self.balance + self.ratio)
+
+    def try_spend(self) -> bool:
+        with self._lock:
+            self._refill()
+            if self.balance >= 1:
+                self.balance -= 1
+                return True
+            self.exhausted_total += 1
+            return False
+
+
+#Politica de reintentos con espera exponencial y jitter completo: la espera del intento n es un valor
+#aleatorio entre 0 y min(max_delay, base_delay * 2**n), o el Retry-After del servidor si es mayor.
+#- respuestas (objetos con status_code) se reintentan si su estado esta en retry_status
+#- excepciones se reintentan si is_retryable_exception(exc) devuelve True
+#Al agotar los intentos se devuelve la ultima respuesta o se relanza la ultima excepcion.
+class RetryPolicy:
+    def __init__(self, name: str, max_attempts: int = 3, base_delay: float = 0.5, max_delay: float = 30,
+                 retry_status=RETRYABLE_STATUS, is_retryable_exception=None, budget: RetryBudget = None):
+        self.name = name
+        self.max_attempts = max(1, max_attempts)
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.retry_status = set(retry_status)
+        self.is_retryable_exception = is_retryable_exception or (lambda exc: False)
+        self.budget = budget
+
+    def backoff(self, attempt: int) -> float:
+        return random.uniform(0, min(self.max_delay, self.base_delay * (2 ** attempt)))
+
+    def _can_retry(self, attempt: int) -> bool:
+        if attempt >= self.max_attempts - 1:
+            return False
+        if self.budget is not None and not self.budget.try_spend():
+            logger.warning("Presupuesto de reintentos agotado, no se reintenta (%s)", self.name)
+            return False
+        return True
+
+    async def run(self, func):
+        if self.budget is not None:
+            self.budget.on_request()
+        for attempt in range(self.max_attempts):
+            retry_after = None
+            try:
+                result = await func()
+            except Exception as e:
+                if not self.is_retryable_exception(e) or not self._can_retry(attempt):
+                    raise
+                logger.warning("Error transitorio en %s (intento %s): %s", self.name, attempt + 1, e)
+            else:
+                status = getattr(result, "status_code", None)
+                if status not in self.retry_status or not self._can_retry(attempt):
+                    return result
+                headers = getattr(result, "headers", None) or {}
+                retry_after = parse_retry_after(headers.get("Retry-After"))
+                logger.warning("Respuesta %s de %s (intento %s), reintentando", status, self.name, attempt + 1)
+
+            delay = self.backoff(attempt)
+            if retry_after is not None:
+                delay = max(delay, min(retry_after, self.max_delay))
+            await asyncio.sleep(delay)
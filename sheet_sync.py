@@ -0,0 +1,146 @@
+import asyncio
+import hashlib
+import json
+import logging
+import time
+
+logger = logging.getLogger(__name__)
+
+
+#estados posibles del resultado de una fila
+STATUS_CREATED = "created"
+STATUS_EXISTING = "existing"
+STATUS_FAILED = "failed"
+STATUS_SKIPPED = "skipped"  #fila sin cambios desde la ultima sincronizacion exitosa
+
+
+#Resultado del procesamiento de una fila de la hoja
+class RowResult:
+    def __init__(self, row_number: int, identification: str, status: str, error: str = None):
+        self.row_number = row_number
+        self.identification = identification
+        self.status = status
+        self.error = error
+
+    def to_dict(self) -> dict:
+        return {
+            "row": self.row_number,
+            "identification": self.identification,
+            "status": self.status,
+            "error": self.error,
+        }
+
+
+#Reporte de una ejecucion de sincronizacion: lleva los contadores por estado y el detalle
+#solo de las filas fallidas, para que la memoria no crezca con el tamaño de la hoja.
+#Se actualiza mientras la sincronizacion avanza, asi summary() sirve tambien como progreso.
+#summary() incluye las primeras SUMMARY_FAILURES filas fallidas (fila, identificacion y motivo)
+class SyncReport:
+    SUMMARY_FAILURES = 20
+
+    def __init__(self):
+        self.counts = {STATUS_CREATED: 0, STATUS_EXISTING: 0, STATUS_FAILED: 0, STATUS_SKIPPED: 0}
+        self.failed_rows = []
+        self.rows_read = 0  #filas leidas de la hoja, incluidas las que aun esperan en la cola
+        self.started_at = time.time()
+        self.finished_at = None
+
+    def add(self, result: RowResult):
+        self.counts[result.status] = self.counts.get(result.status, 0) + 1
+        if result.status == STATUS_FAILED:
+            self.failed_rows.append(result)
+
+    def count(self, status: str) -> int:
+        return self.counts.get(status, 0)
+
+    def total(self) -> int:
+        return sum(self.counts.values())
+
+    def finish(self):
+        self.finished_at = time.time()
+
+    def summary(self) -> dict:
+        finished_at = self.finished_at or time.time()
+        elapsed = finished_at - self.started_at
+        return {
+            "rows_read": self.rows_read,
+            "total": self.total(),
+            STATUS_CREATED: self.count(STATUS_CREATED),
+            STATUS_EXISTING: self.count(STATUS_EXISTING),
+            STATUS_FAILED: self.count(STATUS_FAILED),
+            STATUS_SKIPPED: self.count(STATUS_SKIPPED),
+            "duration_seconds": round(elapsed, 3),
+            "rows_per_second": round(self.total() / elapsed, 2) if elapsed > 0 else 0.0,
+            "failures": self.failures(self.SUMMARY_FAILURES),
+        }
+
+    def failures(self, limit: int = None) -> list:
+        return [result.to_dict() for result in self.failed_rows[:limit]]
+
+
+def row_identification(row) -> str:
+    return row[0].strip() if row and isinstance(row[0], str) else ""
+
+
+#Huella del contenido de una fila. Las celdas vacias al final se ignoran porque la API de
+#Google Sheets las omite de forma inconsistente y no representan un cambio real
+def row_fingerprint(row) -> str:
+    cells = [str(cell).strip() for cell in row]
+    while cells and not cells[-1]:
+        cells.pop()
+    return hashlib.sha256(json.dumps(cells, ensure_ascii=False).encode("utf-8")).hexdigest()
+
+
+#Ejecuta handle_row(row) para cada fila con un numero limitado de workers concurrentes.
+#rows puede ser una lista o un generador asincrono (lectura paginada de la hoja): las filas pasan
+#por una cola acotada, asi los workers empiezan con las primeras filas mientras se descargan las
+#siguientes y no se acumula la hoja completa en memoria.
+#handle_row debe devolver STATUS_CREATED, STATUS_EXISTING o STATUS_SKIPPED; cualquier excepcion o un tiempo
+#mayor a row_timeout marca la fila como fallida sin detener al resto de filas.
+#Si se pasa un report, los contadores se actualizan en el a medida que avanzan las filas.
+#Las filas con atributo row_number (sheet_transform.SheetRow) se reportan con su numero de fila en la hoja
+async def run_sync(rows, handle_row, workers: int = 5, row_timeout: float = 120, report: SyncReport = None) -> SyncReport:
+    report = report or SyncReport()
+    workers = max(1, workers)
+    queue = asyncio.Queue(maxsize=workers * 2)
+
+    async def producer():
+        row_number = 0
+        try:
+            if hasattr(rows, "__aiter__"):
+                async for row in rows:
+                    row_number += 1
+                    report.rows_read += 1
+                    await queue.put((getattr(row, "row_number", None) or row_number, row))
+            else:
+                for row in rows:
+                    row_number += 1
+                    report.rows_read += 1
+                    await queue.put((getattr(row, "row_number", None) or row_number, row))
+        finally:
+            for _ in range(workers):
+                await queue.put(None)  #señal de fin para cada worker
+
+    async def worker():
+        while True:
+            item = await queue.get()
+            if item is None:
+                return
+            row_number, row = item
+            identification = row_identification(row)
+            try:
+                status = await asyncio.wait_for(handle_row(row), timeout=row_timeout)
+                report.add(RowResult(row_number, identification, status))
+            except asyncio.TimeoutError:
+                logger.error("Tiempo agotado procesando la fila %s (%s)", row_number, identification)
+                report.add(RowResult(row_number, identification, STATUS_FAILED, "Tiempo de procesamiento agotado"))
+            except Exception as e:
+                logger.error("Error procesando la fila %s (%s): %s", row_number, identification, e)
+                report.add(RowResult(row_number, identification, STATUS_FAILED, str(e)))
+
+    #si la lectura de la hoja falla el error se propaga despues de que los workers terminan las filas recibidas
+    results = await asyncio.gather(producer(), *(worker() for _ in range(workers)), return_exceptions=True)
+    report.finish()
+    if isinstance(results[0], BaseException):
+        raise results[0]
+    return report
@@ -0,0 +1,155 @@
+#Validacion y transformacion por paginas de las filas de la hoja de registros al formato de clientes de Siigo.
+#Cada pagina se rellena a un esquema fijo de SHEET_COLUMNS columnas en una sola pasada, se transpone a
+#columnas y las columnas obligatorias se validan como mascaras; asi una fila corta nunca produce IndexError
+#y una pagina de mil filas se transforma en unos pocos milisegundos.
+SHEET_COLUMNS = 31  #A:AE
+
+#posiciones de las columnas de la hoja
+COL_IDENTIFICATION = 0
+COL_NAMES = 3
+COL_CUSTOMER_TYPE = 4
+COL_BUSINESS_NAME = 5
+COL_FIRST_NAME = 6
+COL_LAST_NAME = 7
+COL_ADDRESS = 9
+COL_PHONE = 14
+COL_VAT = 16
+COL_EMAIL = 24
+COL_STATUS = 30
+
+#columnas obligatorias para Siigo, en el orden en que se validan; una fila reporta solo el primer error
+REQUIRED_COLUMNS = (
+    (COL_IDENTIFICATION, "La identificación es obligatoria."),
+    (COL_NAMES, "Los nombres y apellidos son obligatorios."),
+    (COL_CUSTOMER_TYPE, "El tipo de Cliente es Obligatorio."),
+    (COL_BUSINESS_NAME, "La Razon Social es Obligatoria."),
+)
+
+NOT_VAT_RESPONSIBLE = "0 - No responsable de IVA"
+
+_FILLER = [""] * SHEET_COLUMNS
+
+
+#Fila de la hoja ya rellenada y validada; lleva su numero de fila en la hoja y el cuerpo para Siigo.
+#Es una lista, asi row_identification y row_fingerprint la tratan igual que una fila leida de la hoja
+class SheetRow(list):
+    def __init__(self, cells, row_number: int = None, siigo_payload: dict = None):
+        super().__init__(cells)
+        self.row_number = row_number
+        self.siigo_payload = siigo_payload
+
+
+#Resultado de transformar una pagina: las filas validas con su cuerpo para Siigo y una tabla de errores
+#por columnas (row, identification, error) con solo las filas invalidas
+class PageTransform:
+    def __init__(self, rows: list, errors: dict):
+        self.rows = rows
+        self.errors = errors
+
+    def error_count(self) -> int:
+        return len(self.errors["row"])
+
+    #la tabla de errores como lista de registros
+    def error_records(self) -> list:
+        return [
+            {"row": row, "identification": identification, "error": error}
+            for row, identification, error in zip(self.errors["row"], self.errors["identification"], self.errors["error"])
+        ]
+
+
+#completa la fila con celdas vacias hasta SHEET_COLUMNS (o la recorta si trae columnas de mas)
+def pad_row(row) -> list:
+    if len(row) < SHEET_COLUMNS:
+        return list(row) + _FILLER[len(row):]
+    return list(row[:SHEET_COLUMNS])
+
+
+def pad_page(rows) -> list:
+    return [pad_row(row) for row in rows]
+
+
+#primer error de validacion de cada fila (None si la fila es valida), calculado columna por columna
+def required_column_errors(columns) -> list:
+    errors = [None] * len(columns[0])
+    for column, message in REQUIRED_COLUMNS:
+        errors = [error or (None if value else message) for error, value in zip(errors, columns[column])]
+    return errors
+
+
+#cuerpo de creacion de cliente en Siigo
+def siigo_customer_payload(identification, first_name, last_name, address, phone, vat, email, status) -> dict:
+    return {
+        "type": "Customer",
+        "person_type": "Person",
+        "id_type": "13",  # Asumimos que siempre es 13, ajusta si es necesario
+        "identification": identification,  # Número de identificación
+        "check_digit": "7",  # Este valor se ajusta si es necesario
+        "name": [first_name, last_name],
+        "commercial_name": f"{first_name} {last_name}",  # Usamos nombre y apellido como nombre comercial
+        "branch_office": 0,
+        "active": status.lower() != "inactivo",  # Activo si no es "Inactivo"
+        "vat_responsible": vat != NOT_VAT_RESPONSIBLE,
+        "fiscal_responsibilities": [{"code": "R-99-PN"}],  # se ajusta si es necesario
+        "address": {
+            "address": address,
+            "city": {
+                "country_code": "Co",
+                "state_code": "19",  # se ajusta si es necesario
+                "city_code": "19001"
+            },
+            "postal_code": "110111"  # se ajusta si es necesario
+        },
+        "phones": [{"indicative": "57", "number": phone, "extension": ""}],
+        "contacts": [
+            {
+                "first_name": first_name,  # Usamos el mismo nombre del cliente
+                "last_name": last_name,
+                "email": email,
+                "phone": {"indicative": "57", "number": phone, "extension": ""}
+            }
+        ],
+        "comments": "",
+        "related_users": [],
+        "seller": None,
+        "assigned_user": None,
+        "account_group": None,
+        "custom_fields": []
+    }
+
+
+#cuerpo para Siigo de una fila ya rellenada
+def row_to_siigo_payload(row) -> dict:
+    return siigo_customer_payload(
+        row[COL_IDENTIFICATION], row[COL_FIRST_NAME], row[COL_LAST_NAME], row[COL_ADDRESS],
+        row[COL_PHONE], row[COL_VAT], row[COL_EMAIL], row[COL_STATUS],
+    )
+
+
+#Valida y transforma una pagina de filas. row_numbers son los numeros de fila en la hoja (paralelo a rows)
+def transform_page(rows: list, row_numbers: list) -> PageTransform:
+    if not rows:
+        return PageTransform([], {"row": [], "identification": [], "error": []})
+
+    padded = pad_page(rows)
+    columns = list(zip(*padded))
+    errors = required_column_errors(columns)
+
+    payloads = [
+        siigo_customer_payload(*fields) if error is None else None
+        for error, *fields in zip(
+            errors, columns[COL_IDENTIFICATION], columns[COL_FIRST_NAME], columns[COL_LAST_NAME],
+            columns[COL_ADDRESS], columns[COL_PHONE], columns[COL_VAT], columns[COL_EMAIL], columns[COL_STATUS],
+        )
+    ]
+    valid_rows = [
+        SheetRow(row, row_number, payload)
+        for row, row_number, payload in zip(padded, row_numbers, payloads)
+        if payload is not None
+    ]
+    invalid = [index for index, error in enumerate(errors) if error is not None]
+    error_table = {
+        "row": [row_numbers[index] for index in invalid],
+        "identification": [str(columns[COL_IDENTIFICATION][index]).strip() for index in invalid],
+        "error": [errors[index] for index in invalid],
+    }
+    return PageTransform(valid_rows, error_table)
@@ -1,2 +1,139 @@
+import asyncio
+import logging
+import time
+
+import httpx
+
+logger = logging.getLogger(__name__)
+
+
 class SiigoAPIError(Exception):
-    pass
\ No newline at end of file
+    pass
+
+
+#Cache del token de acceso de Siigo compartido por todo el proceso.
+#El token se reutiliza hasta poco antes de su expiracion (expires_in) y solo se permite
+#una renovacion en vuelo a la vez: las corrutinas concurrentes esperan el mismo resultado.
+class SiigoTokenManager:
+    def __init__(self, fetch_token, refresh_margin: float = 300, default_ttl: float = 3600):
+        self._fetch_token = fetch_token        #corrutina fetch_token(client) -> dict con access_token y expires_in
+        self._refresh_margin = refresh_margin  #segundos antes de la expiracion en que se renueva el token
+        self._default_ttl = default_ttl        #vigencia asumida si Siigo no envia expires_in
+        self._token = None
+        self._expires_at = 0.0
+        self._lock = asyncio.Lock()
+
+    def _is_valid(self) -> bool:
+        return self._token is not None and time.monotonic() < self._expires_at - self._refresh_margin
+
+    #devuelve el token en cache o lo renueva si esta por expirar.
+    #stale_token: token que Siigo rechazo con 401; si sigue en cache se fuerza la renovacion
+    async def get_token(self, client, stale_token: str = None) -> str:
+        if self._is_valid() and (stale_token is None or stale_token != self._token):
+            return self._token
+
+        async with self._lock:
+            #otra corrutina pudo haber renovado el token mientras se esperaba el lock
+            if self._is_valid() and (stale_token is None or stale_token != self._token):
+                return self._token
+
+            logger.debug("Renovando token de acceso de Siigo")
+            token_data = await self._fetch_token(client)
+            access_token = token_data.get("access_token") if token_data else None
+            if not access_token:
+                raise SiigoAPIError("Token de acceso no encontrado en la respuesta de Siigo")
+
+            expires_in = token_data.get("expires_in") or self._default_ttl
+            self._token = access_token
+            self._expires_at = time.monotonic() + float(expires_in)
+            return self._token
+
+
+#Limitador de tasa (token bucket) compartido por todas las llamadas a Siigo.
+#Arranca con la cuota por minuto configurada; ante un 429 reduce la tasa a la mitad y pausa las
+#solicitudes el tiempo indicado en Retry-After, y con cada respuesta exitosa recupera la tasa
+#gradualmente hasta la cuota maxima (aumento aditivo, disminucion multiplicativa).
+class SiigoRateLimiter:
+    def __init__(self, requests_per_minute: float, burst: int = None, min_requests_per_minute: float = None):
+        self.max_rate = requests_per_minute / 60.0
+        self.min_rate = (min_requests_per_minute or max(1.0, requests_per_minute * 0.1)) / 60.0
+        self.rate = self.max_rate
+        self.capacity = burst or max(1, int(requests_per_minute // 10))
+        self.tokens = float(self.capacity)
+        self.throttled_total = 0
+        self._updated = time.monotonic()
+        self._paused_until = 0.0
+        self._lock = asyncio.Lock()  #los que esperan turno se atienden en orden de llegada
+
+    def _refill(self):
+        now = time.monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self._updated) * self.rate)
+        self._updated = now
+
+    #espera hasta que haya cupo para una solicitud
+    async def acquire(self):
+        async with self._lock:
+            while True:
+                now = time.monotonic()
+                if now < self._paused_until:
+                    await asyncio.sleep(self._paused_until - now)
+                    continue
+                self._refill()
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                await asyncio.sleep((1 - self.tokens) / self.rate)
+
+    #Siigo respondio 429: se reduce la tasa y se pausa segun Retry-After
+    def on_throttled(self, retry_after: float = None):
+        self.throttled_total += 1
+        self.rate = max(self.min_rate, self.rate * 0.5)
+        self.tokens = 0.0
+        pause = retry_after if retry_after is not None else 1 / self.rate
+        self._paused_until = max(self._paused_until, time.monotonic() + pause)
+        logger.warning("Siigo limito las solicitudes (429), nueva tasa %.1f/min, pausa de %.1f s", self.rate * 60, pause)
+
+    def on_success(self):
+        if self.rate < self.max_rate:
+            self.rate = min(self.max_rate, self.rate + self.max_rate * 0.02)
+
+    #cupo disponible en este momento (numero de solicitudes que se pueden hacer sin esperar)
+    def headroom(self) -> float:
+        if time.monotonic() < self._paused_until:
+            return 0.0
+        self._refill()
+        return self.tokens
+
+    def stats(self) -> dict:
+        return {
+            "requests_per_minute": round(self.rate * 60, 2),
+            "max_requests_per_minute": round(self.max_rate * 60, 2),
+            "headroom": round(self.headroom(), 2),
+            "paused_seconds": round(max(0.0, self._paused_until - time.monotonic()), 2),
+            "throttled_total": self.throttled_total,
+        }
+
+
+#Crea el cliente HTTP compartido para todas las llamadas a Siigo. Reutilizar un solo cliente
+#mantiene las conexiones (y el handshake TLS) abiertas entre solicitudes.
+#http2 requiere el paquete opcional h2; si no esta instalado se usa HTTP/1.1
+def create_http_client(max_connections: int = 20, max_keepalive_connections: int = 10,
+                       keepalive_expiry: float = 30, timeout: float = 30,
+                       connect_timeout: float = 10, http2: bool = False) -> httpx.AsyncClient:
+    if http2:
+        try:
+            import h2  # noqa: F401
+        except ImportError:
+            logger.warning("El paquete h2 no esta instalado, se usara HTTP/1.1 para Siigo")
+            http2 = False
+
+    limits = httpx.Limits(
+        max_connections=max_connections,
+        max_keepalive_connections=max_keepalive_connections,
+        keepalive_expiry=keepalive_expiry,
+    )
+    return httpx.AsyncClient(
+        limits=limits,
+        timeout=httpx.Timeout(timeout, connect=connect_timeout),
+        http2=http2,
+    )
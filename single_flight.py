@@ -0,0 +1,22 @@
+#Agrupacion de llamadas concurrentes con la misma clave (single-flight)
+import asyncio
+
+
+#Si llega una llamada con una clave que ya tiene una operacion en curso, no se inicia otra:
+#la llamada espera y recibe el mismo resultado (o la misma excepcion) que la primera.
+#La operacion corre como tarea propia, asi que si quien la inicio se cancela (por ejemplo el
+#cliente HTTP se desconecta) los demas siguen esperando el resultado.
+class SingleFlight:
+    def __init__(self):
+        self._inflight = {}
+
+    def in_flight(self) -> int:
+        return len(self._inflight)
+
+    async def do(self, key, func):
+        task = self._inflight.get(key)
+        if task is None:
+            task = asyncio.ensure_future(func())
+            self._inflight[key] = task
+            task.add_done_callback(lambda _: self._inflight.pop(key, None))
+        return await asyncio.shield(task)
@@ -0,0 +1,273 @@
+#Coordinacion de las ejecuciones de la sincronizacion de la hoja: una sola ejecucion activa a la vez
+import asyncio
+import collections
+import logging
+import time
+import uuid
+
+logger = logging.getLogger(__name__)
+
+
+class SyncLockLostError(Exception):
+    pass
+
+
+#Una ejecucion de la sincronizacion. Estados: queued (en cola), waiting (otro worker esta sincronizando),
+#running, done y failed. `triggers` cuenta los disparos que se agruparon en esta ejecucion
+class SyncRun:
+    QUEUED = "queued"
+    WAITING = "waiting"
+    RUNNING = "running"
+    DONE = "done"
+    FAILED = "failed"
+
+    def __init__(self, reason: str, options: dict = None, partial: bool = False):
+        self.run_id = uuid.uuid4().hex[:12]
+        self.reason = reason
+        self.options = options or {}
+        self.partial = partial  #solo un rango o un subconjunto de filas: no mueve la marca de sincronizacion
+        self.status = self.QUEUED
+        self.triggers = 1
+        self.created_at = time.time()
+        self.started_at = None
+        self.finished_at = None
+        self.summary = None
+        self.error = None
+        self.progress = None  #objeto con summary() que run_func actualiza durante la ejecucion (SyncReport)
+
+    @property
+    def finished(self) -> bool:
+        return self.status in (self.DONE, self.FAILED)
+
+    def duration(self) -> float:
+        if self.started_at is None:
+            return 0.0
+        return (self.finished_at or time.time()) - self.started_at
+
+    def to_dict(self) -> dict:
+        return {
+            "run_id": self.run_id,
+            "reason": self.reason,
+            "options": self.options,
+            "partial": self.partial,
+            "status": self.status,
+            "triggers": self.triggers,
+            "created_at": self.created_at,
+            "started_at": self.started_at,
+            "finished_at": self.finished_at,
+            "duration_seconds": round(self.duration(), 3),
+            "summary": self.summary,
+            "progress": self.progress.summary() if self.progress is not None and not self.finished else None,
+            "error": self.error,
+        }
+
+
+#Ejecuta las sincronizaciones de una en una.
+#- trigger() nunca inicia una segunda ejecucion en paralelo: si ya hay una ejecucion en cola con las mismas
+#  opciones, el disparo se agrupa en ella; asi varios disparos durante una ejecucion larga producen una sola
+#  ejecucion de seguimiento
+#- run_lock (opcional, un LeaderLease) evita ejecuciones simultaneas entre workers; mientras otro worker
+#  sincroniza la ejecucion queda en estado waiting
+#  y si pierde el lease a mitad de una ejecucion (otro worker lo tomo) la ejecucion se detiene y queda fallida
+#- al terminar bien una ejecucion completa (no parcial) se guarda la marca de la ultima sincronizacion exitosa;
+#  el estado se lee y escribe en state_store fuera del event loop y state(), lag() y last_duration() usan la
+#  ultima lectura en memoria (refresh_state)
+#- run_store (opcional, un SyncRunStore) recibe una foto de cada ejecucion al cambiar de estado y cada
+#  progress_interval segundos mientras no termine (en cola, esperando o en curso), para que cualquier worker
+#  pueda consultar su progreso y detectar una ejecucion abandonada
+#run_func(run) ejecuta la sincronizacion y devuelve el resumen (dict)
+class SyncCoordinator:
+    STATE_KEY = "sheet_sync"
+
+    def __init__(self, run_func, state_store, run_lock=None, lock_poll_interval: float = 5, history: int = 50,
+                 run_store=None, progress_interval: float = 1):
+        self.run_func = run_func
+        self.state_store = state_store
+        self.run_lock = run_lock
+        self.lock_poll_interval = lock_poll_interval
+        self.run_store = run_store
+        self.progress_interval = progress_interval
+        self.active = None
+        self.runs_total = 0
+        self.coalesced_total = 0
+        self._queue = collections.deque()
+        self._runs = collections.OrderedDict()  #ultimas `history` ejecuciones por id
+        self._history = history
+        self._task = None
+        self._state = None  #ultima lectura del estado guardado en state_store
+
+    async def trigger(self, reason: str, options: dict = None, partial: bool = False) -> SyncRun:
+        options = options or {}
+        for run in self._queue:
+            if run.options == options:
+                run.triggers += 1
+                self.coalesced_total += 1
+                logger.info("Disparo de sincronizacion (%s) agrupado con la ejecucion en cola %s", reason, run.run_id)
+                await self._publish(run)
+                return run
+
+        run = SyncRun(reason, options, partial)
+        self._queue.append(run)
+        self._runs[run.run_id] = run
+        while len(self._runs) > self._history:
+            self._runs.popitem(last=False)
+        await self._publish(run)
+        if self._task is None or self._task.done():
+            self._task = asyncio.create_task(self._drain())
+        return run
+
+    #foto del estado de una ejecucion: la de memoria si es de este worker, si no la guardada en run_store
+    async def snapshot(self, run_id: str) -> dict:
+        run = self._runs.get(run_id)
+        if run is not None:
+            return run.to_dict()
+        if self.run_store is None:
+            return None
+        return await asyncio.to_thread(self.run_store.get, run_id)
+
+    #guarda la foto de la ejecucion fuera del event loop; un error de la base local no detiene la sincronizacion
+    async def _publish(self, run: SyncRun):
+        if self.run_store is None:
+            return
+        try:
+            await asyncio.to_thread(self.run_store.save, run.to_dict())
+        except Exception as e:
+            logger.error("No se pudo guardar el estado de la sincronizacion %s: %s", run.run_id, e)
+
+    #republica la ejecucion actual y las que siguen en cola, asi su foto no parece abandonada
+    async def _publish_progress(self, run: SyncRun):
+        while True:
+            await asyncio.sleep(self.progress_interval)
+            for pending in (run, *self._queue):
+                await self._publish(pending)
+
+    async def _drain(self):
+        while self._queue:
+            run = self._queue.popleft()
+            self.active = run
+            try:
+                await self._execute(run)
+            except Exception as e:
+                #un error inesperado en una ejecucion no detiene las que siguen en cola
+                logger.error("Error al ejecutar la sincronizacion %s: %s", run.run_id, e)
+            finally:
+                self.active = None
+
+    async def _acquire_run_lock(self, run: SyncRun):
+        while not await asyncio.to_thread(self.run_lock.try_acquire):
+            if run.status != SyncRun.WAITING:
+                run.status = SyncRun.WAITING
+                await self._publish(run)
+            await asyncio.sleep(self.lock_poll_interval)
+
+    #renueva el lease mientras corre la ejecucion; termina si otro worker lo tomo
+    async def _renew_run_lock(self, run: SyncRun):
+        while True:
+            await asyncio.sleep(self.run_lock.ttl / 3)
+            try:
+                if not await asyncio.to_thread(self.run_lock.try_acquire):
+                    return
+            except Exception as e:
+                #se reintenta en la siguiente vuelta; si el lease vence mientras tanto, try_acquire devolvera False
+                logger.error("No se pudo renovar el lease de la sincronizacion %s: %s", run.run_id, e)
+
+    #ejecuta run_func mientras se renueva el lease; si se pierde se cancela run_func para no sincronizar
+    #la hoja desde dos workers a la vez
+    async def _run_holding_lock(self, run: SyncRun) -> dict:
+        work = asyncio.create_task(self.run_func(run))
+        renew_task = asyncio.create_task(self._renew_run_lock(run))
+        try:
+            await asyncio.wait((work, renew_task), return_when=asyncio.FIRST_COMPLETED)
+            if not work.done():
+                raise SyncLockLostError(f"Se perdio el lease {self.run_lock.name}, otro worker tomo la sincronizacion")
+            return work.result()
+        finally:
+            work.cancel()
+            renew_task.cancel()
+            await asyncio.gather(work, renew_task, return_exceptions=True)
+
+    async def _execute(self, run: SyncRun):
+        locked = False
+        progress_task = asyncio.create_task(self._publish_progress(run))
+        try:
+            if self.run_lock is not None:
+                await self._acquire_run_lock(run)
+                locked = True
+
+            run.status = SyncRun.RUNNING
+            run.started_at = time.time()
+            self.runs_total += 1
+            logger.info("Sincronizacion %s iniciada (%s)", run.run_id, run.reason)
+            if locked:
+                run.summary = await self._run_holding_lock(run)
+            else:
+                run.summary = await self.run_func(run)
+            if not run.partial:
+                await self._update_state({
+                    "watermark": run.started_at,  #todo lo que estaba en la hoja al iniciar esta ejecucion quedo sincronizado
+                    "last_success_run_id": run.run_id,
+                    "last_duration_seconds": round(run.duration(), 3),
+                })
+            run.status = SyncRun.DONE
+            run.finished_at = time.time()
+        except Exception as e:
+            run.status = SyncRun.FAILED
+            run.error = str(e)
+            run.finished_at = time.time()
+            logger.error("Sincronizacion %s fallida: %s", run.run_id, e)
+            try:
+                await self._update_state({"last_failure_at": run.finished_at, "last_error": str(e)})
+            except Exception as state_error:
+                logger.error("No se pudo guardar el estado de la sincronizacion %s: %s", run.run_id, state_error)
+        finally:
+            progress_task.cancel()
+            await self._publish(run)
+            if locked:
+                try:
+                    await asyncio.to_thread(self.run_lock.release)
+                except Exception as e:
+                    logger.error("No se pudo liberar el lease de la sincronizacion %s: %s", run.run_id, e)
+
+    #lee el estado guardado fuera del event loop y actualiza la copia en memoria; si la base local falla
+    #se conserva la ultima lectura
+    async def refresh_state(self) -> dict:
+        try:
+            self._state = await asyncio.to_thread(self.state_store.get, self.STATE_KEY)
+        except Exception as e:
+            logger.error("No se pudo leer el estado de la sincronizacion: %s", e)
+        return self._state
+
+    async def _update_state(self, changes: dict):
+        state = await asyncio.to_thread(self.state_store.get, self.STATE_KEY) or {}
+        state.update(changes)
+        await asyncio.to_thread(self.state_store.set, self.STATE_KEY, state)
+        self._state = state
+
+    def state(self) -> dict:
+        return self._state
+
+    #segundos desde la ultima sincronizacion exitosa (None si nunca se ha sincronizado)
+    def lag(self) -> float:
+        state = self.state() or {}
+        watermark = state.get("watermark")
+        return time.time() - watermark if watermark else None
+
+    def last_duration(self) -> float:
+        return (self.state() or {}).get("last_duration_seconds")
+
+    def status(self) -> dict:
+        lag = self.lag()
+        return {
+            "active": self.active.to_dict() if self.active else None,
+            "queued": [run.to_dict() for run in self._queue],
+            "runs_total": self.runs_total,
+            "coalesced_total": self.coalesced_total,
+            "lag_seconds": round(lag, 1) if lag is not None else None,
+            "state": self.state(),
+        }
+
+    async def stop(self):
+        self._queue.clear()
+        if self._task is not None:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
@@ -0,0 +1,79 @@
+#Trazas (spans) compatibles con OpenTelemetry y un id de solicitud que acompaña a los logs
+import contextvars
+import logging
+import sys
+import uuid
+from contextlib import contextmanager
+
+try:
+    from opentelemetry import trace
+except ImportError:  #sin opentelemetry-api los spans no hacen nada
+    trace = None
+
+logger = logging.getLogger(__name__)
+
+
+#id de la solicitud en curso; se propaga a las tareas asyncio creadas durante la solicitud
+request_id_var = contextvars.ContextVar("request_id", default="-")
+
+_provider = None
+
+
+def new_request_id() -> str:
+    return uuid.uuid4().hex
+
+
+#agrega el atributo request_id a cada registro de log para poder usar %(request_id)s en el formato
+class RequestIdFilter(logging.Filter):
+    def filter(self, record: logging.LogRecord) -> bool:
+        record.request_id = request_id_var.get()
+        return True
+
+
+#Configura la exportacion de spans: "console" (salida estandar), "file" (una linea JSON por span en `path`)
+#o "none". Requiere opentelemetry-sdk; si no esta instalado los spans se crean pero no se exportan.
+#Los spans se exportan en lote desde un hilo aparte para no agregar latencia a las solicitudes
+def setup_tracing(service_name: str, exporter: str = "console", path: str = None) -> bool:
+    global _provider
+    if trace is None or exporter == "none":
+        return False
+    try:
+        from opentelemetry.sdk.resources import Resource
+        from opentelemetry.sdk.trace import TracerProvider
+        from opentelemetry.sdk.trace.export import BatchSpanProcessor, ConsoleSpanExporter
+    except ImportError:
+        logger.warning("opentelemetry-sdk no esta instalado, las trazas no se exportan")
+        return False
+
+    out = open(path, "a", encoding="utf-8") if exporter == "file" else sys.stdout
+    span_exporter = ConsoleSpanExporter(out=out, formatter=lambda span: span.to_json(indent=None) + "\n")
+    _provider = TracerProvider(resource=Resource.create({"service.name": service_name}))
+    _provider.add_span_processor(BatchSpanProcessor(span_exporter))
+    trace.set_tracer_provider(_provider)
+    return True
+
+
+#exporta los spans pendientes antes de cerrar el proceso
+def shutdown_tracing():
+    if _provider is not None:
+        _provider.shutdown()
+
+
+class _NoopSpan:
+    def set_attribute(self, key, value):
+        pass
+
+
+#Abre un span hijo del span actual. Las excepciones que salen del bloque quedan registradas en el
+#span y lo marcan con estado de error. Los atributos con valor None se omiten
+@contextmanager
+def start_span(name: str, **attributes):
+    if trace is None:
+        yield _NoopSpan()
+        return
+    with trace.get_tracer("timbale").start_as_current_span(name) as span:
+        span.set_attribute("request.id", request_id_var.get())
+        for key, value in attributes.items():
+            if value is not None:
+                span.set_attribute(key, value)
+        yield span